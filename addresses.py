@@ -0,0 +1,73 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from sketches import hash_values
+
+
+# Id used for NULL addresses
+NULL_ID = -1
+
+
+class AddressTable:
+    """Process-wide mapping from wallet address strings to dense int32 ids
+
+    Ids are handed out in first-seen order and never change, so id arrays
+    can be stored, compared and aggregated in place of the hex strings.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._addresses = []
+        self._array = np.empty(0, dtype=object)
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._addresses)
+
+    def intern(self, values):
+        """Return the int32 id of every value, assigning ids to new addresses"""
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        # The extra slot makes code -1 (NULL) map to NULL_ID
+        lookup = np.full(len(uniques) + 1, NULL_ID, dtype=np.int32)
+        with self._lock:
+            for i, address in enumerate(uniques):
+                address_id = self._ids.get(address)
+                if address_id is None:
+                    address_id = self._ids[address] = len(self._addresses)
+                    self._addresses.append(address)
+                lookup[i] = address_id
+        return lookup[codes]
+
+    def lookup(self, ids):
+        """Return the address strings for ids (None for NULL_ID)"""
+        if len(self._array) != len(self._addresses):
+            with self._lock:
+                array = np.empty(len(self._addresses), dtype=object)
+                array[:] = self._addresses
+                self._array = array
+        ids = np.asarray(ids, dtype=np.int64)
+        addresses = np.empty(len(ids), dtype=object)
+        valid = ids != NULL_ID
+        addresses[valid] = self._array[ids[valid]]
+        return addresses
+
+    def hashes(self, ids):
+        """Return the sketch hash of each id's address string
+
+        Ids depend on the order a process saw addresses in; these hashes
+        don't, so sketches built from them agree across workers.
+        """
+        with self._lock:
+            known = len(self._hashes)
+            if known != len(self._addresses):
+                self._hashes = np.concatenate([
+                    self._hashes, hash_values(np.asarray(self._addresses[known:], dtype=object))
+                ])
+            table = self._hashes
+        return table[np.asarray(ids, dtype=np.int64)]
+
+
+address_table = AddressTable()
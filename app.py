@@ -1,26 +1,39 @@
 from flask import Flask, render_template, jsonify, request
 import pandas as pd
-import requests
 from datetime import datetime, timedelta
-from functools import lru_cache
 import numpy as np
 import traceback
 import os
 
+from db import execute_sql, execute_sql_batch
+from sql_templates import sql_template
+from time_windows import get_oldest_time, resolve_window
+from snapshot import SNAPSHOT_ENABLED, volume_snapshot
+from fill_times import fill_time_facts, fill_time_sketches
+from response_cache import RESPONSE_CACHE_SHORT_TTL, response_cache
+from rollups import (volume_cube, asset_ranking, hourly_ring, daily_metrics, address_activity, chain_asset_volume, cumulative_asset_volume,
+                     cumulative_unique, daily_asset_volume, daily_volume_by, hourly_asset_volume,
+                     hourly_total_volume, short_term_hours)
+
 app = Flask(__name__)
+response_cache.init_app(app)
+
+@app.before_request
+def start_background_sync():
+    # Started per worker on first request, after gunicorn has forked
+    if SNAPSHOT_ENABLED:
+        volume_snapshot.start()
+    response_cache.start()
 
 @app.after_request
 def add_header(response):
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '-1'
+    # Cached payloads and static files set their own policy (revalidated with
+    # ETag / Last-Modified); anything else is rendered per request
+    if 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = 'no-store'
     return response
 
 
-# Constants
-SUPABASE_URL = os.environ.get('SUPABASE_URL')
-SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
-
 # Time ranges
 TIME_RANGES = {
     "all": None,
@@ -30,6 +43,15 @@ TIME_RANGES = {
     "180": 180 # Last 6 Months
 }
 
+# Ranges each dashboard panel offers, warmed into the response cache
+DASHBOARD_RANGES = tuple(TIME_RANGES)
+
+# Seconds browsers may reuse a day-granularity panel before revalidating
+LONG_RANGE_MAX_AGE = 60
+USER_ANALYSIS_RANGES = ('7', '30', '90', '180', 'all')
+SHORT_TERM_RANGES = ('1', '3', '7', '14')
+MACH_TRADES_RANGES = ('0.5', '1', '3', '5', '7')
+
 # Cache for metrics
 metrics_cache = {}
 
@@ -37,43 +59,11 @@ metrics_cache = {}
 #FIXED_END_DATE = "2024-04-24 17:00:00" 
 
 
-def execute_sql(query):
-
-    #query = query.replace("CURRENT_TIMESTAMP", f"'{FIXED_END_DATE}'::timestamp")
-    #query = query.replace("NOW()", f"'{FIXED_END_DATE}'::timestamp")
-    
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
-    }
-    rpc_endpoint = f"{SUPABASE_URL}/rest/v1/rpc/execute_sql"
-    payload = {"query": query}
-    
-    response = requests.post(rpc_endpoint, headers=headers, json=payload)
-    
-    if response.status_code == 200:
-        data = response.json()
-        df = pd.DataFrame(data)
-        return df
-    else:
-        print("Error executing query:", response.status_code, response.json())
-        return None
-
-@lru_cache(maxsize=1)
-def get_oldest_time():
-    time_query = """
-    SELECT MIN(op.block_timestamp) AS oldest_time
-    FROM order_placed op
-    INNER JOIN match_executed me
-    ON op.order_uuid = me.order_uuid
-    """
-    time_point = execute_sql(time_query)
-    time_point = pd.json_normalize(time_point['result'])
-    return time_point['oldest_time'][0]
-
 def get_metrics(start_date):
-    query = f"""
+    if daily_metrics.ready.is_set():
+        return daily_metrics.metrics(start_date) or create_default_metrics()
+
+    query = sql_template('get_metrics', """
     WITH user_stats AS (
         SELECT 
             user_address,
@@ -81,11 +71,11 @@ def get_metrics(start_date):
         FROM (
             SELECT sender_address as user_address
             FROM main_volume_table
-            WHERE block_timestamp >= '{start_date}'
+            WHERE block_timestamp >= :start_date
             UNION ALL
             SELECT maker_address as user_address
             FROM main_volume_table
-            WHERE block_timestamp >= '{start_date}'
+            WHERE block_timestamp >= :start_date
         ) all_users
         GROUP BY user_address
     ),
@@ -103,7 +93,7 @@ def get_metrics(start_date):
                 ELSE 0 
             END) as last_day_volume
         FROM main_volume_table
-        WHERE block_timestamp >= '{start_date}'
+        WHERE block_timestamp >= :start_date
     )
     SELECT 
         v.total_volume,
@@ -117,11 +107,11 @@ def get_metrics(start_date):
     FROM volume_stats v
     CROSS JOIN user_stats u
     GROUP BY v.total_volume, v.trade_count, v.last_day_volume
-    """
+    """).bind(start_date=start_date)
     
     result = execute_sql(query)
-    if result is not None and 'result' in result and len(result['result']) > 0:
-        metrics = result['result'][0]
+    if result is not None and not result.empty:
+        metrics = result.iloc[0]
         return {
             'total_volume': float(metrics['total_volume'] or 0),
             'total_users': int(metrics['total_users'] or 0),
@@ -208,7 +198,7 @@ def get_assets():
     """
     
     asset_list = execute_sql(asset_query)
-    return pd.json_normalize(asset_list['result'])['id'].tolist()
+    return asset_list['id'].tolist()
 
 def get_assets_day():
 
@@ -257,7 +247,7 @@ def get_assets_day():
     ORDER BY total_volume DESC
     """
     asset_list = execute_sql(query)
-    asset_list = pd.json_normalize(asset_list['result'])['id'].tolist()
+    asset_list = asset_list['id'].tolist()
     asset_list = [asset for asset in asset_list if asset != ""]
     return asset_list
 
@@ -266,9 +256,9 @@ def get_weekly_volume(asset_id, start_date=None):
     if not start_date:
         start_date = get_oldest_time()
     
-    query = f"""
+    query = sql_template('get_weekly_volume', """
     WITH RECURSIVE date_series AS (
-        SELECT DATE_TRUNC('day', '{start_date}'::timestamp) AS day
+        SELECT DATE_TRUNC('day', :start_date::timestamp) AS day
         UNION ALL
         SELECT day + INTERVAL '1 day'
         FROM date_series
@@ -279,14 +269,14 @@ def get_weekly_volume(asset_id, start_date=None):
             DATE_TRUNC('day', block_timestamp) AS day,
             SUM(total_volume) AS daily_volume
         FROM main_volume_table
-        WHERE block_timestamp >= '{start_date}'
+        WHERE block_timestamp >= :start_date
         GROUP BY DATE_TRUNC('day', block_timestamp)
     ),
     filled_daily_volume_table AS (
         SELECT 
             ds.day,
             COALESCE(dv.daily_volume, 0) AS daily_volume,
-            '{asset_id}' AS asset
+            :asset_id AS asset
         FROM date_series ds
         LEFT JOIN daily_volume_table dv
         ON ds.day = dv.day
@@ -306,9 +296,9 @@ def get_weekly_volume(asset_id, start_date=None):
         asset
     FROM weekly_averaged_volume_table
     ORDER BY day
-    """
+    """).bind(start_date=start_date, asset_id=asset_id)
     
-    return pd.json_normalize(execute_sql(query)['result'])
+    return execute_sql(query, schema={'total_weekly_avg_volume': 'float64'})
 
 def preload_metrics():
     """Preload metrics and chart data for all time ranges"""
@@ -318,25 +308,14 @@ def preload_metrics():
         # Initialize metrics cache
         metrics_cache = {}
         
-        # Get oldest time for 'all' time range
-        oldest_time = get_oldest_time()
-        if oldest_time:
-            metrics_cache['all'] = get_metrics(oldest_time)
-        else:
-            metrics_cache['all'] = create_default_metrics()
-
-        # Get metrics for each specific time range
-        current_time = datetime.now()
-        time_ranges = ['15', '30', '90', '180']
-        
-        for days in time_ranges:
+        # Get metrics for each time range, including 'all'
+        for time_range in TIME_RANGES:
             try:
-                days_int = int(days)
-                start_date = (current_time - timedelta(days=days_int)).strftime('%Y-%m-%dT%H:%M:%S')
-                metrics_cache[days] = get_metrics(start_date)
+                window = resolve_window(time_range)
+                metrics_cache[time_range] = get_metrics(window.start)
             except Exception as e:
-                print(f"Error loading metrics for {days} days: {str(e)}")
-                metrics_cache[days] = create_default_metrics()
+                print(f"Error loading metrics for {time_range} days: {str(e)}")
+                metrics_cache[time_range] = create_default_metrics()
         
         # Store in application context
         app.config['metrics_cache'] = metrics_cache
@@ -381,6 +360,7 @@ def create_default_sankey():
     }).get_json()
 
 @app.route('/get_assets_day')
+@response_cache.fallback
 def get_assets_day():
 
     query = """
@@ -428,8 +408,8 @@ def get_assets_day():
     ORDER BY total_volume DESC
     """
     df = execute_sql(query)
-    if df is not None and 'result' in df:
-        asset_list = pd.json_normalize(df['result'])['id'].tolist()
+    if df is not None and not df.empty:
+        asset_list = df['id'].tolist()
         return jsonify({"assets": asset_list})  # Return a dictionary instead of a list
     return jsonify({"assets": []})  # Return empty list in a dictionary if no results
 
@@ -445,18 +425,15 @@ def dashboard():
     return render_template('dashboard.html', metrics=metrics_cache['all'])
 
 @app.route('/update_metrics')
+@response_cache.fallback
 def update_metrics():
     time_range = request.args.get('range', 'all')
     
     try:
-        if time_range == 'all':
-            start_date = get_oldest_time()
-        else:
-            days = int(time_range)
-            start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%S')
+        window = resolve_window(time_range)
         
         # Get new metrics directly
-        metrics = get_metrics(start_date)
+        metrics = get_metrics(window.start)
         return jsonify(metrics)
         
     except Exception as e:
@@ -464,6 +441,7 @@ def update_metrics():
         return jsonify(create_default_metrics())
 
 @app.route('/get_hourly_volume')
+@response_cache.fallback
 def get_hourly_volume():
     query = """
     WITH latest_date AS (
@@ -533,7 +511,7 @@ def get_hourly_volume():
     ORDER BY DATE_TRUNC('hour', svt.block_timestamp)
     """
 
-    query_3 = f"""
+    query_3 = """
     SELECT 
         TO_CHAR(DATE_TRUNC('hour', svt.block_timestamp AT TIME ZONE 'UTC' AT TIME ZONE 'America/New_York'), 'HH12 AM') AS hour,
         COALESCE(SUM(svt.total_volume), 0) AS total_hourly_volume,
@@ -547,18 +525,19 @@ def get_hourly_volume():
     ORDER BY DATE_TRUNC('hour', svt.block_timestamp AT TIME ZONE 'UTC' AT TIME ZONE 'America/New_York')
     """
     
-    df = execute_sql(query_3)
-    if df is not None and 'result' in df:
-        return jsonify(pd.json_normalize(df['result']).to_dict(orient='records'))
+    df = hourly_total_volume() if hourly_ring.ready.is_set() else execute_sql(query_3)
+    if df is not None and not df.empty:
+        return jsonify(df.to_dict(orient='records'))
     return jsonify([])  # Return empty array if no data
 
 @app.route('/get_weekly_volume')
+@response_cache.fallback
 def get_weekly_volume():
     today = datetime.now()
     date = today - timedelta(days=7)
     date = date.strftime('%Y-%m-%dT%H:%M:%S')
     
-    query = f"""
+    query = """
         WITH source_volume_table AS (
             SELECT DISTINCT
                 op.*, 
@@ -651,7 +630,7 @@ def get_weekly_volume():
         ORDER BY DATE_TRUNC('day', svt.date)
         """
     
-    query_2 = f"""
+    query_2 = """
         SELECT 
             TO_CHAR(DATE_TRUNC('day', svt.block_timestamp), 'FMMonth FMDD, YYYY') AS day,
             COALESCE(SUM(svt.total_volume), 0) AS total_daily_volume,
@@ -663,8 +642,7 @@ def get_weekly_volume():
     
     print("Executing weekly volume query")  # Debug print
     df = execute_sql(query_2)
-    if df is not None and 'result' in df:
-        df = pd.json_normalize(df['result'])
+    if df is not None and not df.empty:
         #print("Before date filter:", df)  # Debug print
         df = df[pd.to_datetime(df['day']) > pd.to_datetime(date)]
         #print("After date filter:", df)  # Debug print
@@ -775,13 +753,13 @@ def get_weekly_volume():
         """
     
     df = execute_sql(query_2)
-    if df is not None and 'result' in df:
-        df = pd.json_normalize(df['result'])
+    if df is not None and not df.empty:
         df = df[pd.to_datetime(df['day']) > pd.to_datetime(date)]
         return jsonify(df.to_dict(orient='records'))
     return jsonify([])
 
 @app.route('/get_hourly_volume_by_asset/<asset_id>')
+@response_cache.fallback
 def get_hourly_volume_by_asset(asset_id):
 
     # New function for individual asset volumes
@@ -789,7 +767,7 @@ def get_hourly_volume_by_asset(asset_id):
     date = today - timedelta(days=7)
     date = date.strftime('%Y-%m-%dT%H:%M:%S')
 
-    query = f"""
+    query = sql_template('get_hourly_volume_by_asset', """
     WITH latest_date AS (
         SELECT DATE_TRUNC('day', MAX(block_timestamp)) AS max_date
         FROM main_volume_table
@@ -797,7 +775,7 @@ def get_hourly_volume_by_asset(asset_id):
     SELECT 
         TO_CHAR(DATE_TRUNC('hour', svt.block_timestamp), 'HH12 AM') AS hour,
         COALESCE(SUM(svt.total_volume), 0) AS total_hourly_volume,
-        '{asset_id}' AS asset
+        :asset_id AS asset
     FROM main_volume_table svt
     WHERE svt.block_timestamp >= (
         SELECT max_date - INTERVAL '1 day' 
@@ -807,19 +785,19 @@ def get_hourly_volume_by_asset(asset_id):
         SELECT max_date 
         FROM latest_date
     )
-    AND svt.source_id = '{asset_id}' OR svt.dest_id = '{asset_id}'
+    AND (svt.source_id = :asset_id OR svt.dest_id = :asset_id)
     GROUP BY DATE_TRUNC('hour', svt.block_timestamp)
     ORDER BY DATE_TRUNC('hour', svt.block_timestamp)
-    """
+    """).bind(asset_id=asset_id)
 
-    df = execute_sql(query)
-    if df is not None and 'result' in df:
-        df = pd.json_normalize(df['result'])
+    df = hourly_asset_volume(asset_id) if hourly_ring.ready.is_set() else execute_sql(query)
+    if df is not None and not df.empty:
         return jsonify(df.to_dict(orient='records'))
     return jsonify([])
 
 
 @app.route('/get_assets')
+@response_cache.fallback
 def get_assets_route():
     query = """
     WITH consolidated_volumes AS (
@@ -850,9 +828,12 @@ def get_assets_route():
     LIMIT 15
     """
     
-    df = execute_sql(query)
-    if df is not None and 'result' in df:
-        asset_list = pd.json_normalize(df['result'])['id'].tolist()
+    if volume_cube.ready.is_set():
+        df = asset_ranking.top(None, 15, excluded=('usualx',)).volume.rename_axis('id').reset_index()
+    else:
+        df = execute_sql(query)
+    if df is not None and not df.empty:
+        asset_list = df['id'].tolist()
         #print("\nAvailable assets:")
         #print(f"Total number of assets: {len(asset_list)}")
         #print("Asset list:", asset_list)
@@ -860,25 +841,29 @@ def get_assets_route():
     return jsonify({"assets": []})
 
 @app.route('/get_weekly_volume/<time_range>')
+@response_cache.cached('time_range', warm=DASHBOARD_RANGES, max_age=LONG_RANGE_MAX_AGE)
 def weekly_volume(time_range):
     try:
-        if time_range == 'all':
-            start_date = get_oldest_time()
-        else:
-            try:
-                days = int(time_range)
-                start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%S')
-            except ValueError:
-                return jsonify({"error": "Invalid time range"}), 400
-
-        sql_query = f"""
+        try:
+            window = resolve_window(time_range)
+        except ValueError:
+            return jsonify({"error": "Invalid time range"}), 400
+        start_date = window.start
+
+        if volume_cube.ready.is_set():
+            df = daily_asset_volume(start_date)
+            if len(df) == 0:
+                return jsonify({"error": "No data available"}), 500
+            return jsonify(df.to_dict(orient='records'))
+
+        sql_query = sql_template('weekly_volume', """
         WITH filtered_data AS (
             SELECT 
                 block_timestamp,
                 source_volume as volume,
                 source_id as asset
             FROM main_volume_table
-            WHERE block_timestamp >= '{start_date}'
+            WHERE block_timestamp >= :start_date
             AND source_id NOT IN ('usualx', '0', 'O', '')
             UNION ALL
             SELECT 
@@ -886,7 +871,7 @@ def weekly_volume(time_range):
                 dest_volume as volume,
                 dest_id as asset
             FROM main_volume_table
-            WHERE block_timestamp >= '{start_date}'
+            WHERE block_timestamp >= :start_date
             AND dest_id NOT IN ('usualx', '0', 'O', '')
         ),
         date_series AS (
@@ -952,14 +937,10 @@ def weekly_volume(time_range):
         ORDER BY 
             day,
             asset
-        """
+        """).bind(start_date=start_date)
 
-        result = execute_sql(sql_query)
-        if result is None or 'result' not in result:
-            return jsonify({"error": "No data available"}), 500
-
-        df = pd.json_normalize(result['result'])
-        if len(df) == 0:
+        df = execute_sql(sql_query, schema={'daily_volume': 'float64', 'cumulative_volume': 'float64'})
+        if df is None or len(df) == 0:
             return jsonify({"error": "No data available"}), 500
 
         return jsonify(df.to_dict(orient='records'))
@@ -970,21 +951,22 @@ def weekly_volume(time_range):
         return jsonify({"error": str(e)}), 500
 
 @app.route('/get_weekly_volume_by_asset/<asset>')
+@response_cache.fallback
 def get_weekly_volume_by_asset(asset):
     
     if asset != 'Total':
-        query_2 = f"""
+        query_2 = sql_template('get_weekly_volume_by_asset', """
             SELECT 
                 TO_CHAR(DATE_TRUNC('day', svt.block_timestamp), 'FMMonth FMDD, YYYY') AS day,
                 COALESCE(SUM(svt.total_volume), 0) AS total_daily_volume,
-                '{asset}' AS asset
+                :asset AS asset
             FROM main_volume_table svt
-            WHERE svt.source_id = '{asset}' OR svt.dest_id = '{asset}'
+            WHERE svt.source_id = :asset OR svt.dest_id = :asset
             GROUP BY DATE_TRUNC('day', svt.block_timestamp)
             ORDER BY DATE_TRUNC('day', svt.block_timestamp)
-            """
+            """).bind(asset=asset)
     else:
-        query_2 = f"""
+        query_2 = """
             SELECT 
                 TO_CHAR(DATE_TRUNC('day', svt.block_timestamp), 'FMMonth FMDD, YYYY') AS day,
                 COALESCE(SUM(svt.total_volume), 0) AS total_daily_volume,
@@ -995,14 +977,15 @@ def get_weekly_volume_by_asset(asset):
             """
 
     df = execute_sql(query_2)
-    if df is not None and 'result' in df:
-        return jsonify(pd.json_normalize(df['result']).to_dict(orient='records'))
+    if df is not None and not df.empty:
+        return jsonify(df.to_dict(orient='records'))
     return jsonify([])
 
 @app.route('/get_weekly_average_by_asset/<asset>')
+@response_cache.fallback
 def get_weekly_average_by_asset(asset):
     if asset != 'Total':
-        query = f"""
+        query = sql_template('get_weekly_average_by_asset', """
         WITH date_series AS (
             -- Generate a series of dates from the minimum to the maximum block timestamp
             SELECT 
@@ -1016,16 +999,16 @@ def get_weekly_average_by_asset(asset):
             SELECT 
                 DATE_TRUNC('day', svt.block_timestamp) AS day,
                 SUM(svt.total_volume) AS daily_volume,
-                '{asset}' AS asset
+                :asset AS asset
                 FROM main_volume_table svt
-                WHERE svt.source_id = '{asset}' OR svt.dest_id = '{asset}'
+                WHERE svt.source_id = :asset OR svt.dest_id = :asset
                 GROUP BY DATE_TRUNC('day', svt.block_timestamp)
         ),
         filled_daily_volume_table AS (
             SELECT 
                 ds.day,
                 COALESCE(dv.daily_volume, 0) AS daily_volume,
-                '{asset}' AS asset
+                :asset AS asset
             FROM date_series ds
             LEFT JOIN daily_volume_table dv
             ON ds.day = dv.day
@@ -1046,9 +1029,9 @@ def get_weekly_average_by_asset(asset):
             asset
         FROM weekly_averaged_volume_table
         ORDER BY day
-        """
+        """).bind(asset=asset)
     else:
-        query = f"""
+        query = """
         WITH date_series AS (
             -- Generate a series of dates from the minimum to the maximum block timestamp
             SELECT 
@@ -1094,35 +1077,29 @@ def get_weekly_average_by_asset(asset):
         """
 
     df = execute_sql(query)
-    if df is not None and 'result' in df:
-        return jsonify(pd.json_normalize(df['result']).to_dict(orient='records'))
+    if df is not None and not df.empty:
+        return jsonify(df.to_dict(orient='records'))
     return jsonify([])
 
 def get_start_date(time_range):
     """Convert time_range to start_date"""
     try:
-        if time_range == 'all':
-            return get_oldest_time()
-        else:
-            days = int(time_range)
-            return (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%S')
+        return resolve_window(time_range).start
     except ValueError:
         print(f"Invalid time range: {time_range}")
         return None
 
 @app.route('/histogram_data/<time_range>')
+@response_cache.cached('time_range', warm=DASHBOARD_RANGES, max_age=LONG_RANGE_MAX_AGE)
 def get_histogram_data(time_range):
     try:
-        if time_range == 'all':
-            start_date = get_oldest_time()
-        else:
-            try:
-                days = int(time_range)
-                start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%S')
-            except ValueError:
-                return jsonify({"error": "Invalid time range"}), 400
+        try:
+            window = resolve_window(time_range)
+        except ValueError:
+            return jsonify({"error": "Invalid time range"}), 400
+        start_date = window.start
 
-        query = f"""
+        query = sql_template('histogram_data', """
         WITH volume_data AS (
             SELECT 
                 chain,
@@ -1134,14 +1111,14 @@ def get_histogram_data(time_range):
                     source_id as id,
                     source_volume as volume
                 FROM main_volume_table
-                WHERE block_timestamp >= '{start_date}'
+                WHERE block_timestamp >= :start_date
                 UNION ALL
                 SELECT 
                     dest_chain as chain,
                     dest_id as id,
                     dest_volume as volume
                 FROM main_volume_table
-                WHERE block_timestamp >= '{start_date}'
+                WHERE block_timestamp >= :start_date
             ) combined
             GROUP BY chain, id
         ),
@@ -1152,14 +1129,13 @@ def get_histogram_data(time_range):
             ORDER BY SUM(total_volume) DESC
             LIMIT 14
         )
-        SELECT json_build_object(
-            'chain', v.chain,
-            'asset', CASE 
+        SELECT
+            v.chain AS chain,
+            CASE 
                 WHEN v.id IN (SELECT id FROM period_top_assets) THEN v.id 
                 ELSE 'Other'
-            END,
-            'volume', SUM(v.total_volume)
-        ) as result
+            END AS asset,
+            SUM(v.total_volume) AS volume
         FROM volume_data v
         GROUP BY 
             v.chain, 
@@ -1168,18 +1144,21 @@ def get_histogram_data(time_range):
                 ELSE 'Other'
             END
         ORDER BY SUM(v.total_volume) DESC
-        """
+        """).bind(start_date=start_date)
 
-        result = execute_sql(query)
-        if result is None:
+        if volume_cube.ready.is_set():
+            df = chain_asset_volume(start_date)
+        else:
+            df = execute_sql(query, schema={'volume': 'float64'})
+        if df is None:
             return jsonify({"error": "No data available"}), 500
 
-        # Parse the JSON objects in the result column
-        df = pd.json_normalize([r['result'] for r in result['result']])
-
         if len(df) == 0:
             return jsonify({"error": "No data available"}), 500
 
+        # NULL chains go out as null, whichever path built the frame
+        df['chain'] = df['chain'].astype(object).where(df['chain'].notna(), None)
+
         # Process data as before
         chains = df['chain'].unique().tolist()
         assets = df['asset'].unique().tolist()
@@ -1191,8 +1170,10 @@ def get_histogram_data(time_range):
         volume_matrix = []
         for chain in chains:
             chain_volumes = []
+            # == never matches the NULL chain
+            chain_rows = df['chain'].isna() if chain is None else df['chain'] == chain
             for asset in assets:
-                volume = df[(df['chain'] == chain) & (df['asset'] == asset)]['volume'].sum()
+                volume = df[chain_rows & (df['asset'] == asset)]['volume'].sum()
                 chain_volumes.append(float(volume))
             volume_matrix.append(chain_volumes)
 
@@ -1208,25 +1189,17 @@ def get_histogram_data(time_range):
         return jsonify({"error": str(e)}), 500
 
 @app.route('/sankey_data/<time_range>')
+@response_cache.cached('time_range', warm=DASHBOARD_RANGES, max_age=LONG_RANGE_MAX_AGE)
 def sankey_data(time_range):
-    # Check if data is in cache
-    sankey_cache = app.config.get('sankey_cache', {})
-    if time_range in sankey_cache:
-        return sankey_cache[time_range]
-    
-    # If not in cache, generate data (existing code)
     try:
-        # Convert time_range to start_date
-        if time_range == 'all':
-            start_date = get_oldest_time()
-        else:
-            try:
-                days = int(time_range)
-                start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%S')
-            except ValueError:
-                return jsonify({"error": "Invalid time range"}), 400
+        # Convert time_range to a canonical window
+        try:
+            window = resolve_window(time_range)
+        except ValueError:
+            return jsonify({"error": "Invalid time range"}), 400
+        start_date = window.start
 
-        sql_query = f"""
+        sql_query = sql_template('sankey_data', """
         SELECT 
             source_chain,
             source_id,
@@ -1237,16 +1210,27 @@ def sankey_data(time_range):
         FROM 
             main_volume_table
         WHERE
-            block_timestamp >= '{start_date}'
+            block_timestamp >= :start_date
         GROUP BY 
             source_chain, source_id, dest_chain, dest_id
         ORDER BY 
             total_source_volume DESC
-        """
-
-        # Execute query and get results
-        result = execute_sql(sql_query)
-        data = pd.json_normalize(result['result'])
+        """).bind(start_date=start_date)
+
+        if volume_snapshot.ready.is_set():
+            # Aggregate the in-memory snapshot instead of scanning upstream
+            data = volume_snapshot.frame(start_date, names=[
+                'source_chain', 'source_id', 'dest_chain', 'dest_id', 'source_volume', 'dest_volume'
+            ])
+            # Keep NULL chains and assets as their own groups, as GROUP BY does
+            data = data.groupby(['source_chain', 'source_id', 'dest_chain', 'dest_id'], as_index=False,
+                                dropna=False).agg(
+                total_source_volume=('source_volume', 'sum'),
+                total_dest_volume=('dest_volume', 'sum')
+            ).sort_values('total_source_volume', ascending=False)
+        else:
+            # Execute query and get results
+            data = execute_sql(sql_query, schema={'total_source_volume': 'float64', 'total_dest_volume': 'float64'})
 
         # Label sources and destinations
         data["source_chain"] = data["source_chain"] + " (S)"
@@ -1294,25 +1278,18 @@ def sankey_data(time_range):
         return jsonify({"error": str(e)}), 500
 
 @app.route('/user_analysis/<time_range>')
+@response_cache.cached('time_range', warm=USER_ANALYSIS_RANGES, max_age=LONG_RANGE_MAX_AGE)
 def user_analysis(time_range):
-    # Check if data is in cache
-    user_cache = app.config.get('user_cache', {})
-    if time_range in user_cache:
-        return user_cache[time_range]
-    
     try:
-        # Convert time_range to start_date
-        if time_range == 'all':
-            start_date = get_oldest_time()
-        else:
-            try:
-                days = int(time_range)
-                start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%S')
-            except ValueError:
-                return jsonify({"error": "Invalid time range"}), 400
+        # Convert time_range to a canonical window
+        try:
+            window = resolve_window(time_range)
+        except ValueError:
+            return jsonify({"error": "Invalid time range"}), 400
+        start_date = window.start
 
         # Trade rank query
-        sql_query12 = f""" 
+        sql_query12 = sql_template('user_analysis_trade_rank', """
         WITH RankedTrades AS (
         SELECT
             ROW_NUMBER() OVER (ORDER BY COUNT(order_id) DESC) AS rank,
@@ -1321,11 +1298,11 @@ def user_analysis(time_range):
         FROM (
             SELECT sender_address AS address, order_uuid AS order_id
             FROM main_volume_table
-            WHERE block_timestamp >= '{start_date}'
+            WHERE block_timestamp >= :start_date
             UNION ALL
             SELECT maker_address AS address, order_uuid AS order_id
             FROM main_volume_table
-            WHERE block_timestamp >= '{start_date}'
+            WHERE block_timestamp >= :start_date
         ) AS all_trades
         GROUP BY address
         ),
@@ -1342,10 +1319,10 @@ def user_analysis(time_range):
             CAST(cumulative_trade_count * 100.0 / total_trades AS FLOAT) AS percentage_of_total_trades
         FROM CumulativeTrades
         ORDER BY N
-        """
+        """).bind(start_date=start_date)
 
         # Volume rank query
-        sql_query13 = f"""
+        sql_query13 = sql_template('user_analysis_volume_rank', """
         WITH total_volume_table AS (
             SELECT 
                 address,
@@ -1353,11 +1330,11 @@ def user_analysis(time_range):
             FROM (
                 SELECT sender_address AS address, total_volume
                 FROM main_volume_table
-                WHERE block_timestamp >= '{start_date}'
+                WHERE block_timestamp >= :start_date
                 UNION ALL
                 SELECT maker_address AS address, total_volume
                 FROM main_volume_table
-                WHERE block_timestamp >= '{start_date}'
+                WHERE block_timestamp >= :start_date
             ) AS combined_addresses
             GROUP BY address
         ),
@@ -1380,51 +1357,55 @@ def user_analysis(time_range):
             percentage_of_total_volume
         FROM cumulative_volume_table
         WHERE rank <= 300
-        """
+        """).bind(start_date=start_date)
 
         # Top traders query
-        trade_add_query = f"""
+        trade_add_query = sql_template('user_analysis_trade_address', """
         SELECT
             address,
             COUNT(order_id) AS trade_count
         FROM (
             SELECT sender_address AS address, order_uuid AS order_id
             FROM main_volume_table
-            WHERE block_timestamp >= '{start_date}'
+            WHERE block_timestamp >= :start_date
             UNION ALL
             SELECT maker_address AS address, order_uuid AS order_id
             FROM main_volume_table
-            WHERE block_timestamp >= '{start_date}'
+            WHERE block_timestamp >= :start_date
         ) AS all_trades
         GROUP BY address
         ORDER BY trade_count DESC
         LIMIT 200
-        """
+        """).bind(start_date=start_date)
 
         # Top volume query
-        volume_add_query = f"""
+        volume_add_query = sql_template('user_analysis_volume_address', """
         SELECT 
             address,
             COALESCE(SUM(total_volume), 0) AS total_user_volume
         FROM (
             SELECT sender_address AS address, total_volume
             FROM main_volume_table
-            WHERE block_timestamp >= '{start_date}'
+            WHERE block_timestamp >= :start_date
             UNION ALL
             SELECT maker_address AS address, total_volume
             FROM main_volume_table
-            WHERE block_timestamp >= '{start_date}'
+            WHERE block_timestamp >= :start_date
         ) AS combined_addresses
         GROUP BY address
         ORDER BY total_user_volume DESC
         LIMIT 200
-        """
+        """).bind(start_date=start_date)
 
-        # Execute queries and process results
-        df_trade_rank = pd.json_normalize(execute_sql(sql_query12)['result'].head(10))
-        df_volume_rank = pd.json_normalize(execute_sql(sql_query13)['result'].head(10))
-        df_trade_address = pd.json_normalize(execute_sql(trade_add_query)['result'])
-        df_volume_address = pd.json_normalize(execute_sql(volume_add_query)['result'])
+        # Execute queries in one round trip and process results
+        if address_activity.ready.is_set():
+            df_trade_rank, df_volume_rank, df_trade_address, df_volume_address = address_activity.rankings(start_date)
+        else:
+            df_trade_rank, df_volume_rank, df_trade_address, df_volume_address = execute_sql_batch(
+                [sql_query12, sql_query13, trade_add_query, volume_add_query]
+            )
+        df_trade_rank = df_trade_rank.head(10)
+        df_volume_rank = df_volume_rank.head(10)
 
         # Round percentages
         df_trade_rank['percentage_of_total_trades'] = df_trade_rank['percentage_of_total_trades'].round(1)
@@ -1446,31 +1427,29 @@ def user_analysis(time_range):
         return jsonify({"error": str(e)}), 500
 
 @app.route('/pie_data/<time_range>')
+@response_cache.cached('time_range', warm=DASHBOARD_RANGES, max_age=LONG_RANGE_MAX_AGE)
 def pie_data(time_range):
     try:
         print(f"\n=== Starting pie data request for time_range: {time_range} ===")
-        # Convert time_range to start_date
-        if time_range == 'all':
-            start_date = get_oldest_time()
-        else:
-            try:
-                days = int(time_range)
-                start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%S')
-            except ValueError:
-                print(f"Invalid time range value: {time_range}")
-                return jsonify({"error": "Invalid time range"}), 400
+        # Convert time_range to a canonical window
+        try:
+            window = resolve_window(time_range)
+        except ValueError:
+            print(f"Invalid time range value: {time_range}")
+            return jsonify({"error": "Invalid time range"}), 400
+        start_date = window.start
         
         print(f"Using start_date: {start_date}")
 
         # Query for pie charts
-        sql_query = f"""
+        sql_query = sql_template('pie_data', """
         WITH volume_data AS (
             SELECT 
                 source_chain as chain,
                 source_id as asset,
                 source_volume as volume
             FROM main_volume_table
-            WHERE block_timestamp >= '{start_date}'
+            WHERE block_timestamp >= :start_date
             AND source_chain NOT IN ('0', 'O', '')
             AND source_id NOT IN ('0', 'O', '')
             UNION ALL
@@ -1479,7 +1458,7 @@ def pie_data(time_range):
                 dest_id as asset,
                 dest_volume as volume
             FROM main_volume_table
-            WHERE block_timestamp >= '{start_date}'
+            WHERE block_timestamp >= :start_date
             AND dest_chain NOT IN ('0', 'O', '')
             AND dest_id NOT IN ('0', 'O', '')
         ),
@@ -1511,20 +1490,23 @@ def pie_data(time_range):
                 ELSE 'Other'
             END
         ORDER BY total_volume DESC
-        """
+        """).bind(start_date=start_date)
 
         #print("Executing SQL query...")
-        result = execute_sql(sql_query)
+        if volume_cube.ready.is_set():
+            result = chain_asset_volume(start_date, excluded=('0', 'O', '')).rename(columns={'volume': 'total_volume'})
+        else:
+            result = execute_sql(sql_query, schema={'total_volume': 'float64'})
         #print(f"SQL Result type: {type(result)}")
         #if result is not None:
          #   print(f"SQL Result keys: {result.keys() if isinstance(result, dict) else 'Not a dict'}")
          #   print(f"First few rows of result:\n{result.head() if isinstance(result, pd.DataFrame) else result}")
 
-        if result is None or 'result' not in result:
+        if result is None:
             print("No results from query")
             return jsonify({"error": "No data available"}), 500
 
-        df = pd.json_normalize(result['result'])
+        df = result
         #print("\nDataFrame after normalization:")
         #print(f"Columns: {df.columns.tolist()}")
         #print(f"Shape: {df.shape}")
@@ -1563,13 +1545,13 @@ def pie_data(time_range):
         return jsonify({"error": str(e)}), 500
 
 @app.route('/short_term_data/<days>')
+@response_cache.cached('days', ttl=RESPONSE_CACHE_SHORT_TTL, warm=SHORT_TERM_RANGES)
 def short_term_data(days):
     try:
-        days = int(days)
-        start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%S')
+        start_date = resolve_window(days).start
         print(f"Fetching data from {start_date}")
 
-        query = f"""
+        query = sql_template('short_term_data', """
         WITH pre AS (
             SELECT 
                 source_chain AS chain,
@@ -1595,20 +1577,27 @@ def short_term_data(days):
             COALESCE(SUM(volume), 0) AS volume_total,
             array_agg(DISTINCT wallet) AS wallets
         FROM pre
-        WHERE block_timestamp >= '{start_date}'::timestamp
+        WHERE block_timestamp >= :start_date::timestamp
           AND volume > 0
         GROUP BY date_trunc('hour', block_timestamp)
         ORDER BY hour ASC
-        """
+        """).bind(start_date=start_date)
         
-        result = execute_sql(query)
-        result = pd.json_normalize(result['result'])
+        if hourly_ring.ready.is_set() and hourly_ring.covers(start_date):
+            result = short_term_hours(start_date)
+        else:
+            result = execute_sql(query, schema={'trades_count': 'int64', 'volume_total': 'float64'})
         #print("Raw DataFrame:")
         #print(result)
         #print("\nDataFrame Info:")
         #print(result.info())
         #print("\nDataFrame Columns:", result.columns.tolist())
         
+        # Ship running unique-user counts instead of every hour's wallet list
+        if not result.empty:
+            result['cumulative_users'] = cumulative_unique(result['wallets'].tolist())
+            result = result.drop(columns='wallets')
+
         # Convert DataFrame to JSON records
         records = result.to_dict(orient='records')
         return jsonify({'result': records})
@@ -1620,13 +1609,13 @@ def short_term_data(days):
         return jsonify([])
 
 @app.route('/get_mach_trades/<days>')
+@response_cache.cached('days', ttl=RESPONSE_CACHE_SHORT_TTL, warm=MACH_TRADES_RANGES)
 def get_mach_trades(days):
-    days = float(days)
-    interval = f"{days * 24} hours" if days < 1 else f"{days} days"
+    window = resolve_window(days)
     
-    print(f"Fetching Mach trades for interval: {interval}")
+    print(f"Fetching Mach trades since: {window.start}")
     
-    query = f"""
+    query = sql_template('get_mach_trades', """
     WITH pre AS (
         SELECT DISTINCT
             source_chain AS chain,
@@ -1635,7 +1624,7 @@ def get_mach_trades(days):
             transaction_hash,
             sender_address AS wallet
         FROM public.main_volume_table
-        WHERE block_timestamp >= CURRENT_TIMESTAMP - INTERVAL '{interval}'
+        WHERE block_timestamp >= :start_date
           AND source_volume > 0
         UNION ALL
         SELECT DISTINCT
@@ -1645,7 +1634,7 @@ def get_mach_trades(days):
             transaction_hash,
             sender_address AS wallet
         FROM public.main_volume_table
-        WHERE block_timestamp >= CURRENT_TIMESTAMP - INTERVAL '{interval}'
+        WHERE block_timestamp >= :start_date
           AND dest_volume > 0
     ),
     top_trades AS (
@@ -1692,11 +1681,11 @@ def get_mach_trades(days):
         cumulative_volume
     FROM ordered_trades
     ORDER BY block_timestamp ASC
-    """
+    """).bind(start_date=window.start)
     
-    df = execute_sql(query)
-    if df is not None and 'result' in df:
-        result = pd.json_normalize(df['result']).to_dict(orient='records')
+    df = execute_sql(query, schema={'volume': 'float64', 'cumulative_volume': 'float64'})
+    if df is not None and not df.empty:
+        result = df.to_dict(orient='records')
         print(f"Total trades in query: {result[0]['total_trades_count'] if result else 0}")
         print(f"Number of trades returned: {len(result)}")
         print(f"Time range: from {min(r['block_timestamp'] for r in result)} to {max(r['block_timestamp'] for r in result)}")
@@ -1704,14 +1693,19 @@ def get_mach_trades(days):
     return jsonify([])
 
 @app.route('/get_mach_chain_volume/<days>')
+@response_cache.cached('days', warm=('7',), max_age=LONG_RANGE_MAX_AGE)
 def get_mach_chain_volume(days):
-    # Handle 'all' case
-    if days == 'all':
-        where_clause = ""
-    else:
-        where_clause = f"WHERE block_timestamp >= CURRENT_TIMESTAMP - INTERVAL '{days} days'"
+    # 'all' covers every row of main_volume_table
+    try:
+        start_date = None if days == 'all' else resolve_window(days).start
+    except ValueError:
+        print(f"Invalid days: {days}")
+        return jsonify([])
     
-    query = f"""
+    if volume_cube.ready.is_set():
+        return jsonify(daily_volume_by(start_date, 'chain', ('0',)).to_dict(orient='records'))
+
+    query = sql_template('get_mach_chain_volume', """
     WITH pre AS (
         SELECT 
             source_chain as chain,
@@ -1734,25 +1728,31 @@ def get_mach_chain_volume(days):
         date_trunc('day', block_timestamp) as day,
         sum(volume) as total_volume
     FROM pre
-    {where_clause + (' AND ' if where_clause else 'WHERE ') + "chain != '0'"}
+    WHERE (:start_date IS NULL OR block_timestamp >= :start_date)
+    AND chain != '0'
     GROUP BY chain, date_trunc('day', block_timestamp)
     ORDER BY date_trunc('day', block_timestamp) ASC
-    """
+    """).bind(start_date=start_date)
     
-    df = execute_sql(query)
-    if df is not None and 'result' in df:
-        return jsonify(pd.json_normalize(df['result']).to_dict(orient='records'))
+    df = execute_sql(query, schema={'total_volume': 'float64'})
+    if df is not None and not df.empty:
+        return jsonify(df.to_dict(orient='records'))
     return jsonify([])
 
 @app.route('/get_mach_asset_volume/<days>')
+@response_cache.cached('days', warm=('7',), max_age=LONG_RANGE_MAX_AGE)
 def get_mach_asset_volume(days):
-    # Handle 'all' case
-    if days == 'all':
-        where_clause = ""
-    else:
-        where_clause = f"WHERE block_timestamp >= CURRENT_TIMESTAMP - INTERVAL '{days} days'"
+    # 'all' covers every row of main_volume_table
+    try:
+        start_date = None if days == 'all' else resolve_window(days).start
+    except ValueError:
+        print(f"Invalid days: {days}")
+        return jsonify([])
     
-    query = f"""
+    if volume_cube.ready.is_set():
+        return jsonify(daily_volume_by(start_date, 'asset', ('usualx', '0')).to_dict(orient='records'))
+
+    query = sql_template('get_mach_asset_volume', """
     WITH pre AS (
         SELECT 
             source_chain as chain,
@@ -1775,29 +1775,25 @@ def get_mach_asset_volume(days):
         date_trunc('day', block_timestamp) as day,
         sum(volume) as total_volume
     FROM pre
-    {where_clause + (' AND ' if where_clause else 'WHERE ') + "asset != 'usualx' AND asset != '0'"}
+    WHERE (:start_date IS NULL OR block_timestamp >= :start_date)
+    AND asset != 'usualx' AND asset != '0'
     GROUP BY asset, date_trunc('day', block_timestamp)
     ORDER BY date_trunc('day', block_timestamp) ASC, SUM(volume) DESC
-    """
+    """).bind(start_date=start_date)
     
-    df = execute_sql(query)
-    if df is not None and 'result' in df:
-        return jsonify(pd.json_normalize(df['result']).to_dict(orient='records'))
+    df = execute_sql(query, schema={'total_volume': 'float64'})
+    if df is not None and not df.empty:
+        return jsonify(df.to_dict(orient='records'))
     return jsonify([])
 
 @app.route('/get_fill_time_data/<days>')
+@response_cache.cached('days', warm=DASHBOARD_RANGES, max_age=LONG_RANGE_MAX_AGE)
 def get_fill_time_data(days):
-    # Handle 'all' case and convert days parameter
-    if days == 'all':
-        interval = "ALL"
-        where_clause = ""
-    else:
-        days = float(days)
-        interval = f"{days * 24} hours" if days < 1 else f"{days} days"
-        where_clause = f"WHERE op.block_timestamp >= CURRENT_TIMESTAMP - INTERVAL '{interval}'"
+    # Convert days parameter, including 'all', to a canonical window
+    window = resolve_window(days)
       
     # Query for chain pair data
-    chain_pair_query = f"""
+    chain_pair_query = sql_template('fill_time_chain_pairs', """
     WITH deduplicated AS (
         SELECT 
             op.order_uuid,
@@ -1813,7 +1809,7 @@ def get_fill_time_data(days):
           ON op.source_asset = cal.address
         INNER JOIN coingecko_assets_list cal2
           ON op.dest_asset = cal2.address
-        {where_clause}
+        WHERE op.block_timestamp >= :start_date
     ),
     fill_table AS (
       SELECT order_uuid, source_chain, dest_chain, time_order_made, fill_time
@@ -1823,7 +1819,9 @@ def get_fill_time_data(days):
     chain_pair_stats AS (
         SELECT
             source_chain || ' to ' || dest_chain as chain_pair,
-            PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY fill_time) AS median_fill_time
+            PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY fill_time) AS median_fill_time,
+            PERCENTILE_CONT(0.9) WITHIN GROUP (ORDER BY fill_time) AS p90_fill_time,
+            PERCENTILE_CONT(0.99) WITHIN GROUP (ORDER BY fill_time) AS p99_fill_time
         FROM fill_table
         WHERE fill_time > 0
         GROUP BY source_chain, dest_chain
@@ -1832,10 +1830,10 @@ def get_fill_time_data(days):
     SELECT * 
     FROM chain_pair_stats
     WHERE median_fill_time > 0
-    """
+    """).bind(start_date=window.start)
     
     # Query for daily median fill times
-    daily_query = f"""
+    daily_query = sql_template('fill_time_daily', """
     WITH deduplicated AS (
         SELECT 
             op.order_uuid,
@@ -1845,7 +1843,7 @@ def get_fill_time_data(days):
         FROM order_placed op
         INNER JOIN match_executed me
           ON op.order_uuid = me.order_uuid
-        {where_clause}
+        WHERE op.block_timestamp >= :start_date
     ),
     fill_table AS (
       SELECT order_uuid, time_order_made, fill_time
@@ -1855,7 +1853,9 @@ def get_fill_time_data(days):
     daily_stats AS (
         SELECT
             DATE(time_order_made) as date,
-            PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY fill_time) AS median_fill_time
+            PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY fill_time) AS median_fill_time,
+            PERCENTILE_CONT(0.9) WITHIN GROUP (ORDER BY fill_time) AS p90_fill_time,
+            PERCENTILE_CONT(0.99) WITHIN GROUP (ORDER BY fill_time) AS p99_fill_time
         FROM fill_table
         WHERE fill_time > 0
         GROUP BY DATE(time_order_made)
@@ -1863,10 +1863,10 @@ def get_fill_time_data(days):
     )
     SELECT * FROM daily_stats
     WHERE median_fill_time > 0
-    """
+    """).bind(start_date=window.start)
     
     # Query for source chain median fill times
-    source_chain_query = f"""
+    source_chain_query = sql_template('fill_time_source_chains', """
     WITH deduplicated AS (
         SELECT 
             op.order_uuid,
@@ -1878,7 +1878,7 @@ def get_fill_time_data(days):
           ON op.order_uuid = me.order_uuid
         INNER JOIN coingecko_assets_list cal
           ON op.source_asset = cal.address
-        {where_clause}
+        WHERE op.block_timestamp >= :start_date
     ),
     fill_table AS (
       SELECT order_uuid, chain, fill_time
@@ -1891,10 +1891,10 @@ def get_fill_time_data(days):
     FROM fill_table
     GROUP BY chain
     ORDER BY fill_time DESC
-    """
+    """).bind(start_date=window.start)
     
     # Query for destination chain median fill times
-    dest_chain_query = f"""
+    dest_chain_query = sql_template('fill_time_dest_chains', """
     WITH deduplicated AS (
         SELECT 
             op.order_uuid,
@@ -1906,7 +1906,7 @@ def get_fill_time_data(days):
           ON op.order_uuid = me.order_uuid
         INNER JOIN coingecko_assets_list cal
           ON op.dest_asset = cal.address
-        {where_clause}
+        WHERE op.block_timestamp >= :start_date
     ),
     fill_table AS (
       SELECT order_uuid, chain, fill_time
@@ -1919,10 +1919,10 @@ def get_fill_time_data(days):
     FROM fill_table
     GROUP BY chain
     ORDER BY fill_time DESC
-    """
+    """).bind(start_date=window.start)
     
     # Query for lowest fill times
-    lowest_fill_times_query = f"""
+    lowest_fill_times_query = sql_template('fill_time_lowest', """
     WITH deduplicated AS (
         SELECT 
             op.order_uuid,
@@ -1934,7 +1934,7 @@ def get_fill_time_data(days):
         FROM order_placed op
         INNER JOIN match_executed me
           ON op.order_uuid = me.order_uuid
-        {where_clause}
+        WHERE op.block_timestamp >= :start_date
     )
     SELECT 
         order_uuid,
@@ -1944,10 +1944,10 @@ def get_fill_time_data(days):
     WHERE rn = 1 AND fill_time > 0
     ORDER BY fill_time ASC
     LIMIT 10
-    """
+    """).bind(start_date=window.start)
     
     # Query for highest fill times
-    highest_fill_times_query = f"""
+    highest_fill_times_query = sql_template('fill_time_highest', """
     WITH deduplicated AS (
         SELECT 
             op.order_uuid,
@@ -1959,7 +1959,7 @@ def get_fill_time_data(days):
         FROM order_placed op
         INNER JOIN match_executed me
           ON op.order_uuid = me.order_uuid
-        {where_clause}
+        WHERE op.block_timestamp >= :start_date
     )
     SELECT 
         order_uuid,
@@ -1969,31 +1969,48 @@ def get_fill_time_data(days):
     WHERE rn = 1 AND fill_time > 0
     ORDER BY fill_time DESC
     LIMIT 10
-    """
-    
-    chain_pair_data = execute_sql(chain_pair_query)
-    chain_pair_df = pd.json_normalize(chain_pair_data['result'])
-    
-    daily_data = execute_sql(daily_query)
-    daily_df = pd.json_normalize(daily_data['result'])
-    
-    source_chain_data = execute_sql(source_chain_query)
-    source_chain_df = pd.json_normalize(source_chain_data['result'])
-    
-    dest_chain_data = execute_sql(dest_chain_query)
-    dest_chain_df = pd.json_normalize(dest_chain_data['result'])
+    """).bind(start_date=window.start)
     
-    lowest_fill_times_data = execute_sql(lowest_fill_times_query)
-    lowest_fill_times_df = pd.json_normalize(lowest_fill_times_data['result'])
-    
-    highest_fill_times_data = execute_sql(highest_fill_times_query)
-    highest_fill_times_df = pd.json_normalize(highest_fill_times_data['result'])
+    quantile_schema = {'median_fill_time': 'float64', 'p90_fill_time': 'float64', 'p99_fill_time': 'float64'}
+    if fill_time_sketches.ready.is_set():
+        # Medians and tail quantiles come from the merged per-day sketches
+        quantiles = fill_time_sketches.window(window.start)
+        chain_pair_df = quantiles['chain_pairs']
+        daily_df = quantiles['daily']
+        source_chain_df = quantiles['source_chains'][['chain', 'median_fill_time']].rename(
+            columns={'median_fill_time': 'fill_time'})
+        dest_chain_df = quantiles['dest_chains'][['chain', 'median_fill_time']].rename(
+            columns={'median_fill_time': 'fill_time'})
+        # The top-10 lists read the first-match fact table directly
+        lowest_fill_times_df, highest_fill_times_df = fill_time_facts.extremes(window.start)
+    else:
+        # The six queries are independent, so send them as a single batch
+        (chain_pair_df, daily_df, source_chain_df, dest_chain_df,
+         lowest_fill_times_df, highest_fill_times_df) = execute_sql_batch([
+            chain_pair_query,
+            daily_query,
+            source_chain_query,
+            dest_chain_query,
+            lowest_fill_times_query,
+            highest_fill_times_query
+        ], schemas=[
+            quantile_schema,
+            quantile_schema,
+            {'fill_time': 'float64'},
+            {'fill_time': 'float64'},
+            {'fill_time': 'float64'},
+            {'fill_time': 'float64'}
+        ])
     
     response_data = {
         'chain_pairs': chain_pair_df['chain_pair'].tolist(),
         'median_fill_times': chain_pair_df['median_fill_time'].tolist(),
+        'p90_fill_times': chain_pair_df['p90_fill_time'].tolist(),
+        'p99_fill_times': chain_pair_df['p99_fill_time'].tolist(),
         'dates': daily_df['date'].tolist(),
         'daily_medians': daily_df['median_fill_time'].tolist(),
+        'daily_p90': daily_df['p90_fill_time'].tolist(),
+        'daily_p99': daily_df['p99_fill_time'].tolist(),
         'source_chain_data': source_chain_df.to_dict('records'),
         'dest_chain_data': dest_chain_df.to_dict('records'),
         'lowest_fill_times': lowest_fill_times_df.to_dict('records'),
@@ -2003,18 +2020,22 @@ def get_fill_time_data(days):
     return jsonify(response_data)
 
 @app.route('/cumulative_data/<time_range>')
+@response_cache.cached('time_range', warm=DASHBOARD_RANGES, max_age=LONG_RANGE_MAX_AGE)
 def cumulative_data(time_range):
     try:
-        if time_range == 'all':
-            start_date = get_oldest_time()
-        else:
-            try:
-                days = int(time_range)
-                start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%S')
-            except ValueError:
-                return jsonify({"error": "Invalid time range"}), 400
-
-        sql_query = f"""
+        try:
+            window = resolve_window(time_range)
+        except ValueError:
+            return jsonify({"error": "Invalid time range"}), 400
+        start_date = window.start
+
+        if volume_cube.ready.is_set():
+            df = cumulative_asset_volume(start_date)
+            if len(df) == 0:
+                return jsonify({"error": "No data available"}), 500
+            return jsonify(df.to_dict(orient='records'))
+
+        sql_query = sql_template('cumulative_data', """
         WITH all_asset_volumes AS (
             -- Get total volume for each asset to find top assets
             SELECT 
@@ -2044,7 +2065,7 @@ def cumulative_data(time_range):
                 source_volume as volume,
                 source_id as asset
             FROM main_volume_table
-            WHERE block_timestamp >= '{start_date}'
+            WHERE block_timestamp >= :start_date
                 AND source_id IN (SELECT asset_id FROM top_assets)
             UNION ALL
             SELECT 
@@ -2052,7 +2073,7 @@ def cumulative_data(time_range):
                 dest_volume as volume,
                 dest_id as asset
             FROM main_volume_table
-            WHERE block_timestamp >= '{start_date}'
+            WHERE block_timestamp >= :start_date
                 AND dest_id IN (SELECT asset_id FROM top_assets)
         ),
         date_series AS (
@@ -2062,7 +2083,7 @@ def cumulative_data(time_range):
                 '1 day'::interval
             )::date as day
             FROM main_volume_table
-            WHERE block_timestamp >= '{start_date}'
+            WHERE block_timestamp >= :start_date
         ),
         daily_volumes AS (
             SELECT 
@@ -2109,13 +2130,12 @@ def cumulative_data(time_range):
             cumulative_volume
         FROM cumulative_volumes
         ORDER BY day, asset
-        """
+        """).bind(start_date=start_date)
 
-        result = execute_sql(sql_query)
-        if result is None or 'result' not in result:
+        df = execute_sql(sql_query, schema={'cumulative_volume': 'float64'})
+        if df is None:
             return jsonify({"error": "No data available"}), 500
 
-        df = pd.json_normalize(result['result'])
         #print(df)
         if len(df) == 0:
             return jsonify({"error": "No data available"}), 500
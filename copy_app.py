@@ -1,9 +1,11 @@
 from flask import Flask, render_template, jsonify, request
 import pandas as pd
-import requests
 from datetime import datetime, timedelta
 from functools import lru_cache
 
+import db
+from db import SupabaseTransport
+
 app = Flask(__name__)
 
 @app.after_request
@@ -30,24 +32,13 @@ TIME_RANGES = {
 # Cache for metrics
 metrics_cache = {}
 
-def execute_sql(query):
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
-    }
-    rpc_endpoint = f"{SUPABASE_URL}/rest/v1/rpc/execute_sql"
-    payload = {"query": query}
-    
-    response = requests.post(rpc_endpoint, headers=headers, json=payload)
-    
-    if response.status_code == 200:
-        data = response.json()
-        df = pd.DataFrame(data)
-        return df
-    else:
-        print("Error executing query:", response.status_code, response.json())
-        return None
+sql_backend = db.create_backend(SupabaseTransport(SUPABASE_URL, SUPABASE_KEY))
+
+def execute_sql(query, schema=None):
+    return db.execute_sql(query, backend=sql_backend, schema=schema)
+
+def execute_sql_batch(queries):
+    return db.execute_sql_batch(queries, backend=sql_backend)
 
 @lru_cache(maxsize=1)
 def get_oldest_time():
@@ -59,7 +50,6 @@ def get_oldest_time():
     ON op.order_uuid = me.order_uuid
     """
     time_point = execute_sql(time_query)
-    time_point = pd.json_normalize(time_point['result'])
     return time_point['oldest_time'][0]
 
 def get_metrics(start_date):
@@ -170,24 +160,24 @@ def get_metrics(start_date):
     )
     """
 
-    # Execute queries
-    df_volume = execute_sql(sql_query_volume)
-    #df_volume = pd.json_normalize(df_volume['result'])
-
-    df_users = execute_sql(sql_query_users)
-    df_trades = execute_sql(sql_query_trades)
-    df_avg_trades = execute_sql(sql_query_avg_trades)
-    df_perc_above = execute_sql(sql_query_perc_above)
-    df_last_day = execute_sql(sql_query_last_day)
+    # Execute queries in one round trip
+    df_volume, df_users, df_trades, df_avg_trades, df_perc_above, df_last_day = execute_sql_batch([
+        sql_query_volume,
+        sql_query_users,
+        sql_query_trades,
+        sql_query_avg_trades,
+        sql_query_perc_above,
+        sql_query_last_day
+    ])
 
 
     # Process results
-    total_volume = float(pd.json_normalize(df_volume['result'])['sum'].iloc[0])
-    total_users = len(pd.json_normalize(df_users['result']))
-    trade_count = int(pd.json_normalize(df_trades['result'])['count'].iloc[0])
-    average_trades = int(pd.json_normalize(df_avg_trades['result'])['average_trades_per_user'].iloc[0])
-    perc_above = int(pd.json_normalize(df_perc_above['result'])['percent_users_with_more_than_one_trade'].iloc[0])
-    last_day_v = float(pd.json_normalize(df_last_day['result'])['volume'].iloc[0])
+    total_volume = float(df_volume['sum'].iloc[0])
+    total_users = len(df_users)
+    trade_count = int(df_trades['count'].iloc[0])
+    average_trades = int(df_avg_trades['average_trades_per_user'].iloc[0])
+    perc_above = int(df_perc_above['percent_users_with_more_than_one_trade'].iloc[0])
+    last_day_v = float(df_last_day['volume'].iloc[0])
 
     return {
         "total_volume": total_volume,
@@ -274,7 +264,7 @@ def get_assets():
     """
     
     asset_list = execute_sql(asset_query)
-    return pd.json_normalize(asset_list['result'])['id'].tolist()
+    return asset_list['id'].tolist()
 
 def get_assets_day():
 
@@ -323,7 +313,7 @@ def get_assets_day():
     ORDER BY total_volume DESC
     """
     asset_list = execute_sql(query)
-    asset_list = pd.json_normalize(asset_list['result'])['id'].tolist()
+    asset_list = asset_list['id'].tolist()
     asset_list = [asset for asset in asset_list if asset != ""]
     return asset_list
 
@@ -374,7 +364,7 @@ def get_weekly_volume(asset_id, start_date=None):
     ORDER BY day
     """
     
-    return pd.json_normalize(execute_sql(query)['result'])
+    return execute_sql(query, schema={'total_weekly_avg_volume': 'float64'})
 
 def preload_metrics():
     """Preload metrics for all time ranges"""
@@ -440,8 +430,8 @@ def get_assets_day():
     ORDER BY total_volume DESC
     """
     df = execute_sql(query)
-    if df is not None and 'result' in df:
-        asset_list = pd.json_normalize(df['result'])['id'].tolist()
+    if df is not None and not df.empty:
+        asset_list = df['id'].tolist()
         return jsonify({"assets": asset_list})  # Return a dictionary instead of a list
     return jsonify({"assets": []})  # Return empty list in a dictionary if no results
 
@@ -530,8 +520,8 @@ def get_hourly_volume():
     """
     
     df = execute_sql(query_2)
-    if df is not None and 'result' in df:
-        return jsonify(pd.json_normalize(df['result']).to_dict(orient='records'))
+    if df is not None and not df.empty:
+        return jsonify(df.to_dict(orient='records'))
     return jsonify([])  # Return empty array if no data
 
 @app.route('/get_weekly_volume')
@@ -645,8 +635,7 @@ def get_weekly_volume():
     
     print("Executing weekly volume query")  # Debug print
     df = execute_sql(query_2)
-    if df is not None and 'result' in df:
-        df = pd.json_normalize(df['result'])
+    if df is not None and not df.empty:
         print("Before date filter:", df)  # Debug print
         df = df[pd.to_datetime(df['day']) > pd.to_datetime(date)]
         print("After date filter:", df)  # Debug print
@@ -757,8 +746,7 @@ def get_weekly_volume_by_asset(asset_id):
         """
     
     df = execute_sql(query_2)
-    if df is not None and 'result' in df:
-        df = pd.json_normalize(df['result'])
+    if df is not None and not df.empty:
         df = df[pd.to_datetime(df['day']) > pd.to_datetime(date)]
         return jsonify(df.to_dict(orient='records'))
     return jsonify([])
@@ -794,8 +782,7 @@ def get_hourly_volume_by_asset(asset_id):
     """
 
     df = execute_sql(query)
-    if df is not None and 'result' in df:
-        df = pd.json_normalize(df['result'])
+    if df is not None and not df.empty:
         return jsonify(df.to_dict(orient='records'))
     return jsonify([])
 
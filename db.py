@@ -0,0 +1,832 @@
+import codecs
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from shared_cache import shared_cache
+
+
+# Constants
+SUPABASE_URL = os.environ.get('SUPABASE_URL')
+SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
+
+# Transport settings
+POOL_SIZE = int(os.environ.get('SUPABASE_POOL_SIZE', 20))
+CONNECT_TIMEOUT = float(os.environ.get('SUPABASE_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.environ.get('SUPABASE_READ_TIMEOUT', 60))
+MAX_RETRIES = int(os.environ.get('SUPABASE_MAX_RETRIES', 3))
+RETRY_BACKOFF = float(os.environ.get('SUPABASE_RETRY_BACKOFF', 0.5))
+
+# Which execute_sql backend to use: 'supabase' (RPC) or 'duckdb' (local files)
+SQL_BACKEND = os.environ.get('SQL_BACKEND', 'supabase').lower()
+
+# Maximum number of queries a single request may have in flight at once
+QUERY_CONCURRENCY = int(os.environ.get('SQL_QUERY_CONCURRENCY', 6))
+
+# Send multi-query routes through the execute_sql_batch RPC (see sql/execute_sql_batch.sql)
+BATCH_RPC_ENABLED = os.environ.get('SQL_BATCH_RPC', '1') != '0'
+
+# Size of the chunks read from streamed RPC responses
+STREAM_CHUNK_SIZE = int(os.environ.get('SQL_STREAM_CHUNK_SIZE', 64 * 1024))
+
+# Query result cache
+QUERY_CACHE_TTL = float(os.environ.get('SQL_CACHE_TTL', 60))
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get('SQL_CACHE_MAX_ENTRIES', 512))
+QUERY_CACHE_MAX_BYTES = int(os.environ.get('SQL_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# Statuses worth retrying: rate limiting and transient gateway failures
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Circuit breaker: stop querying upstream once this share of the last
+# SQL_CIRCUIT_WINDOW calls (at least SQL_CIRCUIT_MIN_CALLS) failed or took
+# longer than SQL_CIRCUIT_SLOW_SECONDS, and probe every
+# SQL_CIRCUIT_PROBE_INTERVAL seconds until it answers again
+CIRCUIT_WINDOW = int(os.environ.get('SQL_CIRCUIT_WINDOW', 20))
+CIRCUIT_MIN_CALLS = int(os.environ.get('SQL_CIRCUIT_MIN_CALLS', 5))
+CIRCUIT_FAILURE_RATE = float(os.environ.get('SQL_CIRCUIT_FAILURE_RATE', 0.5))
+CIRCUIT_SLOW_SECONDS = float(os.environ.get('SQL_CIRCUIT_SLOW_SECONDS', 15))
+CIRCUIT_PROBE_INTERVAL = float(os.environ.get('SQL_CIRCUIT_PROBE_INTERVAL', 15))
+
+
+class UpstreamError(RuntimeError):
+    """The upstream could not answer: connection error, timeout or 5xx"""
+
+
+class SupabaseTransport:
+    """Shared keep-alive HTTP transport for the Supabase RPC endpoints"""
+
+    def __init__(self, url, key, pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, max_retries=MAX_RETRIES, retry_backoff=RETRY_BACKOFF):
+        self.url = url
+        self.key = key
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._session = None
+        self._lock = threading.Lock()
+        self.batch_rpc_available = BATCH_RPC_ENABLED
+
+    @property
+    def session(self):
+        # Built lazily so gunicorn workers each open their own pool after forking
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def _build_session(self):
+        # The RPC only runs read queries, so retrying the POST is safe
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=self.max_retries,
+            status=self.max_retries,
+            backoff_factor=self.retry_backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(['POST']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size,
+                              max_retries=retry, pool_block=True)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            "apikey": self.key,
+            "Authorization": f"Bearer {self.key}",
+            "Content-Type": "application/json"
+        })
+        return session
+
+    def rpc(self, function, payload, **kwargs):
+        """POST a payload to /rest/v1/rpc/<function> over the pooled session"""
+        rpc_endpoint = f"{self.url}/rest/v1/rpc/{function}"
+        return self.session.post(rpc_endpoint, json=payload, timeout=self.timeout, **kwargs)
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+transport = SupabaseTransport(SUPABASE_URL, SUPABASE_KEY)
+
+
+def normalize_sql(query):
+    """Collapse whitespace so formatting differences map to the same cache key"""
+    return ' '.join(query.split())
+
+
+def query_key(query):
+    """Cache key for a plain SQL string or a bound sql_templates query"""
+    cache_key = getattr(query, 'cache_key', None)
+    return cache_key if cache_key is not None else normalize_sql(query)
+
+
+class QueryCache:
+    """Thread-safe TTL + LRU cache of query results, bounded by entry count and bytes"""
+
+    def __init__(self, max_entries=QUERY_CACHE_MAX_ENTRIES, max_bytes=QUERY_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, count=True):
+        """Cached value or None; count=False leaves the hit/miss stats alone (re-checks)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += count
+                return None
+            self._entries.move_to_end(key)
+            self.hits += count
+            return entry[0]
+
+    def set(self, key, value, ttl, size):
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + ttl, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+query_cache = QueryCache()
+
+
+def _schema_key(schema):
+    return tuple(sorted(schema.items())) if schema else ()
+
+
+def _column(values, dtype):
+    if dtype is None:
+        # No hint: let pandas infer int64/float64/object from the values
+        return values
+    if dtype == 'datetime':
+        return pd.to_datetime(values, utc=True, format='ISO8601')
+    if dtype == 'int64' and any(value is None for value in values):
+        # NULLs can't live in an int64 array
+        dtype = 'float64'
+    return np.asarray(values, dtype=dtype)
+
+
+class ColumnBuilder:
+    """Accumulate rows into per-column lists without keeping the row objects"""
+
+    def __init__(self):
+        self.names = []
+        self.columns = {}
+        self.rows = 0
+
+    def append(self, record):
+        for name, value in record.items():
+            column = self.columns.get(name)
+            if column is None:
+                # A column first seen mid-stream is NULL for the earlier rows
+                column = self.columns[name] = [None] * self.rows
+                self.names.append(name)
+            column.append(value)
+        self.rows += 1
+        for name in self.names:
+            column = self.columns[name]
+            if len(column) < self.rows:
+                column.append(None)
+
+    def frame(self, schema=None):
+        schema = schema or {}
+        if not self.rows:
+            return pd.DataFrame(columns=list(schema))
+        columns = {name: _column(self.columns.pop(name), schema.get(name)) for name in self.names}
+        return pd.DataFrame(columns, columns=self.names)
+
+
+def decode_records(records, schema=None):
+    """Build a typed DataFrame column by column from a list of row objects
+
+    schema optionally maps column names to a dtype ('float64', 'int64',
+    'datetime', ...) so those columns are converted once, up front.
+    """
+    builder = ColumnBuilder()
+    for record in records:
+        builder.append(record)
+    return builder.frame(schema)
+
+
+_json_decoder = json.JSONDecoder()
+
+
+def iter_json_array(chunks):
+    """Yield the elements of a top-level JSON array as its bytes arrive
+
+    Only the undecoded tail of the body is buffered, so the full text and
+    the full object tree never have to exist at the same time.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    started = False
+    finished = False
+
+    for chunk in chunks:
+        buffer = buffer[pos:] + decoder.decode(chunk)
+        pos = 0
+        while not finished:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError("Expected a JSON array from the RPC")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                finished = True
+                break
+            try:
+                element, end = _json_decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Element is split across chunks; wait for more bytes
+                break
+            pos = end
+            yield element
+
+    if not finished:
+        raise ValueError("Truncated JSON array in RPC response")
+
+
+def decode_stream(response, schema=None, unwrap='result'):
+    """Parse a streamed RPC response into a typed DataFrame, column by column
+
+    Returns the frame and the number of body bytes read.
+    """
+    received = [0]
+
+    def chunks():
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            received[0] += len(chunk)
+            yield chunk
+
+    builder = ColumnBuilder()
+    for row in iter_json_array(chunks()):
+        builder.append(row[unwrap] if unwrap else row)
+    return builder.frame(schema), received[0]
+
+
+class CircuitBreaker:
+    """Fails queries fast while the upstream is erroring or slow
+
+    Tracks whether each of the last `window` calls hit an upstream failure
+    (not a rejected query) or exceeded slow_seconds. Once the bad share
+    reaches failure_rate the breaker opens:
+    queries return None at once instead of waiting on the upstream, and a
+    background thread runs `probe` every probe_interval seconds until it
+    succeeds, which closes the breaker again.
+    """
+
+    def __init__(self, probe, window=CIRCUIT_WINDOW, min_calls=CIRCUIT_MIN_CALLS,
+                 failure_rate=CIRCUIT_FAILURE_RATE, slow_seconds=CIRCUIT_SLOW_SECONDS,
+                 probe_interval=CIRCUIT_PROBE_INTERVAL):
+        self.probe = probe
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.probe_interval = probe_interval
+        self.opened_at = None
+        # Failed plus rejected calls so far
+        self.failures = 0
+        self.trips = 0
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """Whether a query may go upstream; counts it as failed if not"""
+        if self.opened_at is None:
+            return True
+        with self._lock:
+            self.failures += 1
+        return False
+
+    def record(self, answered, seconds=None, healthy=None):
+        """Record one upstream call
+
+        healthy (default: answered) is False only for upstream failures, so a
+        query rejected as invalid doesn't count against the upstream. seconds
+        is None for calls expected to be slow, which skip the latency check.
+        """
+        healthy = answered if healthy is None else healthy
+        with self._lock:
+            if not answered:
+                self.failures += 1
+            self._outcomes.append(not healthy or (seconds is not None and seconds > self.slow_seconds))
+            calls = len(self._outcomes)
+            if self.opened_at is None and calls >= self.min_calls and \
+                    sum(self._outcomes) >= self.failure_rate * calls:
+                self._trip()
+
+    def _trip(self):
+        self.opened_at = time.time()
+        self.trips += 1
+        print(f"Circuit breaker open: {sum(self._outcomes)} of the last {len(self._outcomes)} "
+              f"queries failed or took over {self.slow_seconds:.0f}s")
+        threading.Thread(target=self._probe_until_closed, name='sql-circuit-probe', daemon=True).start()
+
+    def _probe_until_closed(self):
+        while True:
+            time.sleep(self.probe_interval)
+            started = time.monotonic()
+            try:
+                ok = self.probe()
+            except Exception as e:
+                print(f"Circuit breaker probe failed: {str(e)}")
+                ok = False
+            if ok and time.monotonic() - started <= self.slow_seconds:
+                self.close()
+                return
+
+    def close(self):
+        with self._lock:
+            if self.opened_at is not None:
+                print(f"Circuit breaker closed after {time.time() - self.opened_at:.0f}s")
+            self.opened_at = None
+            self._outcomes.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open': self.opened_at is not None,
+                'opened_at': self.opened_at,
+                'recent_calls': len(self._outcomes),
+                'recent_bad': sum(self._outcomes),
+                'failures': self.failures,
+                'trips': self.trips
+            }
+
+
+def _cached(key):
+    df = query_cache.get(key)
+    if df is None:
+        df = _cached_shared(key)
+    # Shallow copy so callers adding columns don't touch the cached frame
+    return None if df is None else df.copy(deep=False)
+
+
+def _cached_shared(key):
+    """Adopt a result another worker published, for the rest of its TTL"""
+    entry = shared_cache.get_entry(('query',) + key)
+    if entry is None:
+        return None
+    (df, size), expires_at = entry
+    query_cache.set(key, df, expires_at - time.time(), size)
+    return df
+
+
+def _store(key, df, ttl, size):
+    query_cache.set(key, df, ttl, size)
+    if size <= query_cache.max_bytes:
+        shared_cache.set(('query',) + key, (df, size), ttl)
+
+
+def _error_detail(response):
+    try:
+        return response.json()
+    except ValueError:
+        return response.text
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            # Every waiter sees the leader's result or error
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def do_many(self, keys, fn):
+        """do() for several keys at once: returns {key: result}
+
+        fn(led) is called with the keys nobody else is running and returns
+        {key: result} for them; keys already in flight wait for their leader.
+        """
+        led, joined = {}, {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                call = self._calls.get(key)
+                if call is None:
+                    led[key] = self._calls[key] = _Call()
+                else:
+                    joined[key] = call
+                    self.shared += 1
+
+        results = {}
+        if led:
+            try:
+                computed = fn(list(led))
+                for key, call in led.items():
+                    call.result = results[key] = computed.get(key)
+            except Exception as e:
+                for call in led.values():
+                    call.error = e
+                raise
+            finally:
+                with self._lock:
+                    for key in led:
+                        del self._calls[key]
+                for call in led.values():
+                    call.done.set()
+
+        for key, call in joined.items():
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            results[key] = call.result
+        return results
+
+
+in_flight = SingleFlight()
+
+
+class SupabaseBackend:
+    """Runs queries through the Supabase execute_sql / execute_sql_batch RPCs"""
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.name = transport.url
+
+    @property
+    def supports_batch(self):
+        return self.transport.batch_rpc_available
+
+    def execute(self, query, schema=None):
+        """Return (DataFrame, size in bytes), or None if the query was rejected
+
+        Raises UpstreamError when the upstream itself failed.
+        """
+        try:
+            response = self.transport.rpc('execute_sql', {"query": str(query)}, stream=True)
+            try:
+                if response.status_code >= 500:
+                    raise UpstreamError(f"{response.status_code} {_error_detail(response)}")
+                if response.status_code != 200:
+                    print("Error executing query:", response.status_code, _error_detail(response))
+                    return None
+                # Parse while the body is still arriving instead of buffering it whole
+                return decode_stream(response, schema)
+            finally:
+                response.close()
+        except requests.RequestException as e:
+            raise UpstreamError(str(e)) from e
+        except ValueError as e:
+            print("Error executing query:", str(e))
+            return None
+
+    def execute_batch(self, queries, schemas):
+        """Return one (DataFrame, size) per query, or None to run them one at a time"""
+        try:
+            response = self.transport.rpc('execute_sql_batch', {"queries": [str(query) for query in queries]})
+        except requests.RequestException as e:
+            print("Error executing batch:", str(e))
+            return None
+
+        if response.status_code == 404:
+            # The batch function is not installed upstream; stop asking for it
+            print("execute_sql_batch RPC not available, falling back to individual queries")
+            self.transport.batch_rpc_available = False
+            return None
+        if response.status_code != 200:
+            # One bad statement fails the whole batch, so retry each query on its own
+            print("Error executing batch:", response.status_code, _error_detail(response))
+            return None
+
+        rows = [[] for _ in queries]
+        for row in response.json():
+            rows[row['idx']] = row['result'] or []
+        return [(decode_records(records, schema), len(json.dumps(records)))
+                for schema, records in zip(schemas, rows)]
+
+
+def create_backend(transport=transport):
+    """Build the query backend selected by SQL_BACKEND ('supabase' or 'duckdb')"""
+    if SQL_BACKEND == 'duckdb':
+        # Imported lazily so duckdb stays an optional dependency
+        from local_backend import DuckDBBackend
+        return DuckDBBackend()
+    if SQL_BACKEND != 'supabase':
+        raise ValueError(f"Unknown SQL_BACKEND: {SQL_BACKEND}")
+    return SupabaseBackend(transport)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+
+def _probe():
+    return get_backend().execute('SELECT 1') is not None
+
+
+# Set while caches are filled in the background, where slow queries are expected
+_bulk = ContextVar('bulk_queries', default=False)
+
+
+@contextmanager
+def bulk_queries():
+    """Leave the queries run inside out of the circuit breaker's latency check"""
+    token = _bulk.set(True)
+    try:
+        yield
+    finally:
+        _bulk.reset(token)
+
+
+# Set while refreshing a cache whose entries must not be older than the refresh
+_fresh = ContextVar('fresh_queries', default=False)
+
+
+@contextmanager
+def fresh_queries():
+    """Query upstream inside this block instead of reusing cached results
+
+    Results are still stored for everyone else, and queries already in
+    flight are still joined.
+    """
+    token = _fresh.set(True)
+    try:
+        yield
+    finally:
+        _fresh.reset(token)
+
+
+def _reuse(ttl):
+    return ttl > 0 and not _fresh.get()
+
+
+# Queries that went unanswered in the current unanswered_queries() block
+_unanswered = ContextVar('unanswered_queries', default=None)
+
+
+@contextmanager
+def unanswered_queries():
+    """Collect the keys of queries run inside this block that returned None
+
+    Covers queries run by execute_sql_many's threads for this block, and
+    nothing run by other threads, so a failure elsewhere never marks this
+    work as partial.
+    """
+    missed = []
+    token = _unanswered.set(missed)
+    try:
+        yield missed
+    finally:
+        _unanswered.reset(token)
+
+
+def _timed(started, ttl):
+    # Bulk loads (ttl=0 pages) and background fills are slow by design
+    return None if ttl <= 0 or _bulk.get() else time.monotonic() - started
+
+
+circuit_breaker = CircuitBreaker(_probe)
+
+
+def _fetch_sql(query, key, backend, ttl, schema):
+    """Run one query as its in_flight leader"""
+    if not _reuse(ttl):
+        return _fetch_upstream(query, key, backend, ttl, schema)
+    # A caller that missed the cache just before the previous leader stored
+    # its result and left in_flight leads again; don't query twice
+    df = query_cache.get(key, count=False)
+    if df is not None:
+        return df
+    # One worker per host runs the query; the others wait and read its result
+    with shared_cache.lock(('query',) + key):
+        df = _cached_shared(key)
+        if df is not None:
+            return df
+        return _fetch_upstream(query, key, backend, ttl, schema)
+
+
+def _fetch_upstream(query, key, backend, ttl, schema):
+    if not circuit_breaker.allow():
+        return None
+    started = time.monotonic()
+    healthy = True
+    try:
+        fetched = backend.execute(query, schema)
+    except UpstreamError as e:
+        print("Error executing query:", str(e))
+        fetched, healthy = None, False
+    circuit_breaker.record(fetched is not None, _timed(started, ttl), healthy)
+    if fetched is None:
+        return None
+    df, size = fetched
+    _store(key, df, ttl, size)
+    return df
+
+
+def execute_sql(query, backend=None, ttl=None, schema=None):
+    """Run a query on the configured backend and return its rows as a typed DataFrame
+
+    Repeats are served from query_cache (or shared_cache, when another
+    worker already ran the query), and identical queries already in flight
+    share a single upstream request. Returns None without querying
+    while circuit_breaker is open.
+    """
+    backend = backend or get_backend()
+    ttl = QUERY_CACHE_TTL if ttl is None else ttl
+    key = (backend.name, query_key(query), _schema_key(schema))
+    if _reuse(ttl):
+        df = _cached(key)
+        if df is not None:
+            return df
+
+    df = in_flight.do(key, lambda: _fetch_sql(query, key, backend, ttl, schema))
+    if df is None:
+        _note_unanswered(key)
+        return None
+    return df.copy(deep=False)
+
+
+def _note_unanswered(key):
+    missed = _unanswered.get()
+    if missed is not None:
+        missed.append(key)
+
+
+def execute_sql_many(queries, max_workers=QUERY_CONCURRENCY, backend=None, ttl=None, schemas=None):
+    """Run independent queries concurrently and return their results in order"""
+    queries = list(queries)
+    schemas = list(schemas) if schemas is not None else [None] * len(queries)
+    if len(queries) <= 1 or max_workers <= 1:
+        return [execute_sql(query, backend=backend, ttl=ttl, schema=schema)
+                for query, schema in zip(queries, schemas)]
+
+    workers = min(max_workers, len(queries))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='execute_sql') as executor:
+        # Each query runs in a copy of the caller's context, so its context vars carry over
+        futures = [executor.submit(copy_context().run, execute_sql, query, backend, ttl, schema)
+                   for query, schema in zip(queries, schemas)]
+        return [future.result() for future in futures]
+
+
+def _fetch_batch(items, backend, ttl):
+    """Run (key, query, schema) items this caller leads in in_flight; returns {key: DataFrame or None}"""
+    results = {}
+    if _reuse(ttl):
+        for key, _, _ in items:
+            # The previous leader may have stored it since our cache check
+            df = query_cache.get(key, count=False)
+            if df is not None:
+                results[key] = df
+    items = [item for item in items if item[0] not in results]
+
+    fetched = None
+    if len(items) > 1 and backend.supports_batch and circuit_breaker.allow():
+        started = time.monotonic()
+        fetched = backend.execute_batch([query for _, query, _ in items], [schema for _, _, schema in items])
+        if fetched is not None:
+            # A failed batch is retried query by query, which records those outcomes
+            circuit_breaker.record(True, _timed(started, ttl))
+    if fetched is not None:
+        for (key, _, _), (df, size) in zip(items, fetched):
+            _store(key, df, ttl, size)
+            results[key] = df
+    elif len(items) <= 1 or QUERY_CONCURRENCY <= 1:
+        for key, query, schema in items:
+            results[key] = _fetch_sql(query, key, backend, ttl, schema)
+    else:
+        # Stand-in for the batch RPC: the queries one by one, concurrently.
+        # This caller already leads their keys, so they skip in_flight
+        workers = min(QUERY_CONCURRENCY, len(items))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='execute_sql') as executor:
+            futures = [(key, executor.submit(copy_context().run, _fetch_sql, query, key, backend, ttl, schema))
+                       for key, query, schema in items]
+            results.update((key, future.result()) for key, future in futures)
+    return results
+
+
+def execute_sql_batch(queries, backend=None, ttl=None, schemas=None):
+    """Run several queries in a single round trip and return one DataFrame per query
+
+    Cached results are reused, and queries another caller already has in
+    flight are waited for instead of being sent again.
+    """
+    backend = backend or get_backend()
+    ttl = QUERY_CACHE_TTL if ttl is None else ttl
+    queries = list(queries)
+    schemas = list(schemas) if schemas is not None else [None] * len(queries)
+    keys = [(backend.name, query_key(query), _schema_key(schema))
+            for query, schema in zip(queries, schemas)]
+    results = [_cached(key) if _reuse(ttl) else None for key in keys]
+
+    # Only the queries missing from the cache go upstream
+    pending = {}
+    for i, df in enumerate(results):
+        if df is None:
+            pending.setdefault(keys[i], i)
+    if not pending:
+        return results
+
+    fetched = in_flight.do_many(list(pending), lambda led: _fetch_batch(
+        [(key, queries[pending[key]], schemas[pending[key]]) for key in led], backend, ttl))
+    for i, key in enumerate(keys):
+        if results[i] is None:
+            df = fetched[key]
+            if df is None:
+                _note_unanswered(key)
+            results[i] = None if df is None else df.copy(deep=False)
+    return results
@@ -0,0 +1,326 @@
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from addresses import address_table
+from db import execute_sql
+from sketches import KLL
+from snapshot import EPOCH, SNAPSHOT_LOOKBACK, SNAPSHOT_PAGE_SIZE, _cursor, _datetime64, volume_snapshot
+from sql_templates import sql_template
+
+
+# Quantiles kept for every fill-time group: median, p90 and p99
+FILL_TIME_QUANTILES = (0.5, 0.9, 0.99)
+
+# Column name -> numpy dtype of the fact table arrays
+FACT_COLUMNS = {
+    'order_uuid': object,
+    'time_order_made': 'datetime64[us]',
+    'time_matched': 'datetime64[us]',
+    'source_chain': object,
+    'dest_chain': object,
+    # Senders are stored as address_table ids
+    'sender_address_id': 'int32',
+    'fill_time': 'float64',
+}
+
+_SCHEMA = {
+    'time_order_made': 'datetime',
+    'time_matched': 'datetime',
+    'fill_time': 'float64',
+}
+
+# Orders whose first match landed at or after :since. Chains are looked up
+# with LEFT JOINs so orders on unlisted assets still count towards the
+# daily medians, which never joined coingecko_assets_list.
+_FIRST_MATCH_QUERY = """
+WITH matched AS (
+    SELECT DISTINCT order_uuid
+    FROM match_executed
+    WHERE block_timestamp >= :since
+),
+deduplicated AS (
+    SELECT
+        op.order_uuid,
+        op.block_timestamp AS time_order_made,
+        me.block_timestamp AS time_matched,
+        op.sender_address,
+        cal.chain AS source_chain,
+        cal2.chain AS dest_chain,
+        EXTRACT(EPOCH FROM (me.block_timestamp - op.block_timestamp))::FLOAT AS fill_time,
+        ROW_NUMBER() OVER (PARTITION BY op.order_uuid ORDER BY me.block_timestamp) AS rn
+    FROM order_placed op
+    INNER JOIN match_executed me
+      ON op.order_uuid = me.order_uuid
+    LEFT JOIN coingecko_assets_list cal
+      ON op.source_asset = cal.address
+    LEFT JOIN coingecko_assets_list cal2
+      ON op.dest_asset = cal2.address
+    WHERE op.order_uuid IN (SELECT order_uuid FROM matched)
+)
+SELECT order_uuid, time_order_made, time_matched, sender_address, source_chain, dest_chain, fill_time
+FROM deduplicated
+WHERE rn = 1 AND time_matched >= :since
+ORDER BY time_matched
+LIMIT :limit
+"""
+
+
+def _naive(values):
+    values = pd.DatetimeIndex(values)
+    if values.tz is not None:
+        values = values.tz_convert('UTC').tz_localize(None)
+    return values
+
+
+def _empty_columns():
+    return {name: np.empty(0, dtype=dtype) for name, dtype in FACT_COLUMNS.items()}
+
+
+def _to_columns(df):
+    """Convert a decoded page of first matches into fact table arrays"""
+    columns = {}
+    for name, dtype in FACT_COLUMNS.items():
+        if name.startswith('time_'):
+            columns[name] = _naive(df[name]).to_numpy(dtype)
+        elif name == 'sender_address_id':
+            columns[name] = address_table.intern(df['sender_address'])
+        elif dtype == object:
+            columns[name] = df[name].to_numpy(dtype=object)
+        else:
+            columns[name] = df[name].to_numpy(dtype=dtype, na_value=0)
+    return columns
+
+
+class FillTimeFacts:
+    """First-match fill time of every matched order, sorted by order time
+
+    One row per order: order time, first match time, source and destination
+    chain, sender and fill time. Each sync pulls only the orders whose first
+    match landed since the last one and merges them in, so the join with
+    match_executed and the first-match dedup run once per order.
+    """
+
+    def __init__(self, snapshot, page_size=SNAPSHOT_PAGE_SIZE, lookback=SNAPSHOT_LOOKBACK):
+        self.page_size = page_size
+        self.lookback = timedelta(seconds=lookback)
+        self.ready = threading.Event()
+        self.watermark = None
+        self.version = 0
+        self._columns = _empty_columns()
+        # Orders already stored whose first match is recent enough to be re-read
+        self._recent = set()
+        self._subscribers = []
+        self._extremes = {}
+        self._lock = threading.Lock()
+        snapshot.subscribe(self.on_sync)
+
+    def __len__(self):
+        return len(self._columns['order_uuid'])
+
+    def subscribe(self, callback):
+        """Call callback(facts, rows) with the columns of every batch of new orders"""
+        self._subscribers.append(callback)
+
+    def _fetch(self, since):
+        """Fetch every order whose first match is at or after since, one page at a time"""
+        pages = []
+        limit = self.page_size
+        while True:
+            query = sql_template('fill_time_first_matches', _FIRST_MATCH_QUERY).bind(since=_cursor(since), limit=limit)
+            df = execute_sql(query, ttl=0, schema=_SCHEMA)
+            if df is None:
+                raise RuntimeError(f"First matches from {since} failed")
+            page = _to_columns(df) if not df.empty else _empty_columns()
+            matched = page['time_matched']
+            if len(matched) < limit:
+                pages.append(page)
+                break
+
+            last = matched[-1]
+            if matched[0] == last or last.astype(datetime) <= since:
+                # A whole page shares one timestamp, so the cursor can't
+                # advance; widen the page and retry
+                limit *= 2
+                continue
+            # The next page starts at the last timestamp, so drop its rows here
+            keep = np.searchsorted(matched, last, side='left')
+            pages.append({name: values[:keep] for name, values in page.items()})
+            since = last.astype(datetime)
+            limit = self.page_size
+        return {name: np.concatenate([page[name] for page in pages]) for name in FACT_COLUMNS}
+
+    def on_sync(self, snapshot, since):
+        since = EPOCH if self.watermark is None else (self.watermark - self.lookback).replace(microsecond=0)
+        orders = self._fetch(since)
+        new = ~pd.Series(orders['order_uuid']).isin(self._recent).to_numpy()
+        rows = {name: values[new] for name, values in orders.items()}
+
+        if len(rows['order_uuid']):
+            # Most new orders were placed recently, so only the tail needs re-sorting
+            current = self._columns
+            cut = np.searchsorted(current['time_order_made'], rows['time_order_made'].min(), side='right')
+            tail = {name: np.concatenate([current[name][cut:], rows[name]]) for name in FACT_COLUMNS}
+            order = np.argsort(tail['time_order_made'], kind='stable')
+            columns = {name: np.concatenate([current[name][:cut], tail[name][order]]) for name in FACT_COLUMNS}
+            with self._lock:
+                self._columns = columns
+                self.version += 1
+                self._extremes = {}
+        # Every order first matched at or after since was just read, so
+        # anything older can never be returned again
+        self._recent = set(orders['order_uuid'])
+        if len(orders['time_matched']):
+            self.watermark = max(self.watermark or EPOCH, orders['time_matched'].max().astype(datetime))
+        self.ready.set()
+
+        for callback in list(self._subscribers):
+            try:
+                callback(self, rows)
+            except Exception as e:
+                print(f"Error in fill time subscriber: {str(e)}")
+
+    def columns(self, start=None, end=None, names=None):
+        """Return {name: array} for orders with start <= time_order_made < end"""
+        current = self._columns
+        times = current['time_order_made']
+        lo = 0 if start is None else np.searchsorted(times, _datetime64(start), side='left')
+        hi = len(times) if end is None else np.searchsorted(times, _datetime64(end), side='left')
+        return {name: current[name][lo:hi] for name in (names or FACT_COLUMNS)}
+
+    def extremes(self, start=None, n=10):
+        """(lowest, highest) DataFrames of the n orders placed since start with the
+        smallest and largest positive fill times: order_uuid, address, fill_time
+        """
+        key = (self.version, None if start is None else _datetime64(start), n)
+        cached = self._extremes.get(key)
+        if cached is not None:
+            return cached
+
+        columns = self.columns(start, names=['order_uuid', 'sender_address_id', 'fill_time'])
+        positive = np.flatnonzero(columns['fill_time'] > 0)
+        fill_time = columns['fill_time'][positive]
+        order = np.argsort(fill_time, kind='stable')
+
+        def frame(rows):
+            rows = positive[rows]
+            return pd.DataFrame({
+                'order_uuid': columns['order_uuid'][rows],
+                'address': address_table.lookup(columns['sender_address_id'][rows]),
+                'fill_time': columns['fill_time'][rows],
+            })
+
+        result = (frame(order[:n]), frame(order[::-1][:n]))
+        with self._lock:
+            if self.version == key[0]:
+                self._extremes[key] = result
+        return result
+
+
+def _day_sketches(columns):
+    """{(day, source_chain, dest_chain): KLL} for the positive fill times in columns"""
+    positive = columns['fill_time'] > 0
+    groups = pd.DataFrame({
+        'day': columns['time_order_made'][positive].astype('datetime64[D]'),
+        'source_chain': columns['source_chain'][positive],
+        'dest_chain': columns['dest_chain'][positive],
+        'fill_time': columns['fill_time'][positive],
+    }).groupby(['day', 'source_chain', 'dest_chain'], dropna=False, sort=False)['fill_time']
+    return {(np.datetime64(day, 'D'), _chain(source), _chain(dest)): KLL().update(values.to_numpy())
+            for (day, source, dest), values in groups}
+
+
+def _chain(value):
+    return None if pd.isna(value) else value
+
+
+def _quantile_frame(groups, key, by_median=True):
+    """DataFrame of key plus median/p90/p99 fill times for {key: [sketches]}"""
+    rows = []
+    for value, sketches in sorted(groups.items()):
+        rows.append([value] + KLL.merged(sketches).quantiles(FILL_TIME_QUANTILES).tolist())
+    frame = pd.DataFrame(rows, columns=[key, 'median_fill_time', 'p90_fill_time', 'p99_fill_time'])
+    frame = frame[frame['median_fill_time'] > 0]
+    if by_median:
+        frame = frame.sort_values('median_fill_time', ascending=False, kind='stable')
+    return frame.reset_index(drop=True)
+
+
+class FillTimeSketches:
+    """KLL sketches of first-match fill times per (order day, source chain, dest chain)
+
+    Fed with each batch of new orders from the fact table. Window medians
+    and p90/p99 come from merging the sketches of the window's days; a
+    window starting part-way through a day sketches that day's facts.
+    """
+
+    def __init__(self, facts):
+        self.facts = facts
+        self.ready = threading.Event()
+        self._sketches = {}
+        self._version = 0
+        self._windows = {}
+        self._lock = threading.Lock()
+        facts.subscribe(self.on_orders)
+
+    def on_orders(self, facts, rows):
+        if not len(rows['order_uuid']):
+            self.ready.set()
+            return
+        with self._lock:
+            for key, sketch in _day_sketches(rows).items():
+                current = self._sketches.get(key)
+                # Merge into a new sketch; readers may still hold the current one
+                self._sketches[key] = sketch if current is None else KLL.merged([current, sketch])
+            self._version += 1
+            self._windows = {}
+        self.ready.set()
+
+    def window(self, start=None):
+        """Fill-time quantiles for orders placed at or after start
+
+        Returns a dict of DataFrames: chain_pairs (chain_pair), daily (date),
+        source_chains and dest_chains (chain), each with median_fill_time,
+        p90_fill_time and p99_fill_time, shaped like the SQL they replace.
+        """
+        start = None if start is None else _datetime64(start)
+        with self._lock:
+            key = (self._version, start)
+            cached = self._windows.get(key)
+            if cached is not None:
+                return cached
+            sketches = dict(self._sketches)
+
+        if start is not None:
+            start_day = start.astype('datetime64[D]')
+            sketches = {key: sketch for key, sketch in sketches.items() if key[0] > start_day or
+                        (key[0] == start_day and start == start_day)}
+            if start > start_day:
+                sketches.update(_day_sketches(self.facts.columns(start, start_day + 1)))
+
+        pairs, daily, sources, dests = {}, {}, {}, {}
+        for (day, source, dest), sketch in sketches.items():
+            daily.setdefault(str(day), []).append(sketch)
+            if source is not None:
+                sources.setdefault(source, []).append(sketch)
+            if dest is not None:
+                dests.setdefault(dest, []).append(sketch)
+            if source is not None and dest is not None:
+                pairs.setdefault(f"{source} to {dest}", []).append(sketch)
+
+        result = {
+            'chain_pairs': _quantile_frame(pairs, 'chain_pair'),
+            'daily': _quantile_frame(daily, 'date', by_median=False),
+            'source_chains': _quantile_frame(sources, 'chain'),
+            'dest_chains': _quantile_frame(dests, 'chain'),
+        }
+        with self._lock:
+            if self._version == key[0]:
+                self._windows[key] = result
+        return result
+
+
+fill_time_facts = FillTimeFacts(volume_snapshot)
+fill_time_sketches = FillTimeSketches(fill_time_facts)
@@ -0,0 +1,180 @@
+import glob
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from db import _column
+
+
+# Directory holding one <table>.parquet / .csv / .json file per table
+LOCAL_DATA_DIR = os.environ.get('LOCAL_DATA_DIR', 'data')
+
+# Tables the dashboard queries; anything else found in LOCAL_DATA_DIR is loaded too
+REQUIRED_TABLES = ('main_volume_table', 'order_placed', 'match_executed', 'coingecko_assets_list')
+
+_READERS = {
+    '.parquet': "read_parquet('{path}')",
+    '.csv': "read_csv_auto('{path}')",
+    '.json': "read_json_auto('{path}')",
+}
+
+# Postgres TO_CHAR patterns used by the dashboard, as strftime formats
+_TO_CHAR_FORMATS = {
+    'FMMonth FMDD, YYYY': '%B %-d, %Y',
+    'HH12 AM': '%I %p',
+    'YYYY-MM-DD': '%Y-%m-%d',
+}
+
+
+def _find_calls(sql, name):
+    """Yield (start, open_paren, close_paren) for every name(...) call in sql"""
+    pattern = re.compile(r'\b' + name + r'\s*\(', re.IGNORECASE)
+    pos = 0
+    while True:
+        match = pattern.search(sql, pos)
+        if match is None:
+            return
+        depth = 0
+        quoted = False
+        for i in range(match.end() - 1, len(sql)):
+            char = sql[i]
+            if char == "'":
+                quoted = not quoted
+            elif not quoted and char == '(':
+                depth += 1
+            elif not quoted and char == ')':
+                depth -= 1
+                if depth == 0:
+                    yield match.start(), match.end() - 1, i
+                    break
+        pos = match.end()
+
+
+def _split_args(args):
+    parts, depth, quoted, last = [], 0, False, 0
+    for i, char in enumerate(args):
+        if char == "'":
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and char == ',':
+            parts.append(args[last:i])
+            last = i + 1
+    parts.append(args[last:])
+    return parts
+
+
+def _rewrite_calls(sql, name, rewrite):
+    # Work from the end so earlier offsets stay valid
+    for start, open_paren, close_paren in reversed(list(_find_calls(sql, name))):
+        replacement = rewrite(sql[open_paren + 1:close_paren])
+        sql = sql[:start] + replacement + sql[close_paren + 1:]
+    return sql
+
+
+def _to_char(args):
+    value, fmt = _split_args(args)
+    fmt = fmt.strip().strip("'")
+    return f"strftime({value}, '{_TO_CHAR_FORMATS.get(fmt, fmt)}')"
+
+
+def translate_postgres(sql):
+    """Rewrite the Postgres-only constructs our queries use into DuckDB SQL"""
+    sql = _rewrite_calls(sql, 'TO_CHAR', _to_char)
+    # Postgres expands a select-list generate_series into rows; DuckDB returns a list
+    sql = _rewrite_calls(sql, 'generate_series', lambda args: f"unnest(generate_series({args}))")
+    return sql
+
+
+class DuckDBBackend:
+    """Embedded analytical backend that runs the dashboard's SQL over local files"""
+
+    def __init__(self, data_dir=None):
+        try:
+            import duckdb
+        except ImportError:
+            raise RuntimeError("SQL_BACKEND=duckdb requires the duckdb package (pip install duckdb)")
+
+        self.data_dir = data_dir or LOCAL_DATA_DIR
+        self.name = f"duckdb:{os.path.abspath(self.data_dir)}"
+        self.supports_batch = False
+        self._connection = duckdb.connect(':memory:')
+        # Supabase runs in UTC; keep NOW() and CURRENT_DATE consistent with it
+        self._connection.execute("SET TimeZone = 'UTC'")
+        self._local = threading.local()
+        self.tables = self._load_tables()
+
+        missing = [table for table in REQUIRED_TABLES if table not in self.tables]
+        if missing:
+            print(f"DuckDB backend: no local data for {', '.join(missing)} in {self.data_dir}")
+
+    def _load_tables(self):
+        tables = []
+        self._connection.execute("CREATE SCHEMA IF NOT EXISTS public")
+        for path in sorted(glob.glob(os.path.join(self.data_dir, '*'))):
+            table, extension = os.path.splitext(os.path.basename(path))
+            reader = _READERS.get(extension.lower())
+            if reader is None or table in tables:
+                continue
+            source = reader.format(path=path.replace("'", "''"))
+            self._connection.execute(f'CREATE TABLE "{table}" AS SELECT * FROM {source}')
+            self._normalize_timestamps(table)
+            # Queries use both bare and public.-qualified names
+            self._connection.execute(f'CREATE VIEW public."{table}" AS SELECT * FROM main."{table}"')
+            tables.append(table)
+        print(f"DuckDB backend: loaded {len(tables)} tables from {self.data_dir}")
+        return tables
+
+    def _normalize_timestamps(self, table):
+        # pandas-written parquet stores nanosecond timestamps, which DuckDB
+        # refuses to compare with NOW(); Postgres only keeps microseconds anyway
+        columns = self._connection.execute(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_name = ? AND data_type = 'TIMESTAMP_NS'", [table]
+        ).fetchall()
+        for (column,) in columns:
+            self._connection.execute(
+                f'ALTER TABLE "{table}" ALTER COLUMN "{column}" TYPE TIMESTAMP USING "{column}"::TIMESTAMP'
+            )
+
+    @property
+    def _cursor(self):
+        # DuckDB connections are not thread-safe; each thread gets its own cursor
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            cursor = self._local.cursor = self._connection.cursor()
+        return cursor
+
+    def execute(self, query, schema=None):
+        """Return (DataFrame, size in bytes), or None if the query failed"""
+        try:
+            cursor = self._cursor.execute(translate_postgres(str(query)))
+            dates = [column[0] for column in cursor.description if str(column[1]) == 'DATE']
+            df = cursor.df()
+        except Exception as e:
+            print("Error executing query:", str(e))
+            return None
+        return self._as_rpc_frame(df, schema or {}, dates), int(df.memory_usage(deep=False).sum())
+
+    def execute_batch(self, queries, schemas):
+        return None
+
+    @staticmethod
+    def _as_rpc_frame(df, schema, dates=()):
+        """Shape a DuckDB result like a decoded execute_sql RPC response"""
+        for name in df.columns:
+            column = df[name]
+            if name in schema:
+                df[name] = _column(column.tolist(), schema[name])
+            elif pd.api.types.is_datetime64_any_dtype(column):
+                # The RPC returns dates and timestamps as ISO strings
+                fmt = '%Y-%m-%d' if name in dates else '%Y-%m-%dT%H:%M:%S'
+                df[name] = column.dt.strftime(fmt).where(column.notna(), None)
+            elif column.dtype == object and len(column) and isinstance(column.iloc[0], np.ndarray):
+                df[name] = [value.tolist() for value in column]
+        return df
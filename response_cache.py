@@ -0,0 +1,400 @@
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from db import bulk_queries, circuit_breaker, fresh_queries, unanswered_queries
+from shared_cache import shared_cache
+from time_windows import OldestTimeUnavailable, canonical_range, resolve_window
+
+
+# Cache the JSON responses of the /<time_range> routes (set RESPONSE_CACHE=0 to disable)
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE', '1') != '0'
+
+# Default seconds a response stays fresh; one window bucket
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 300))
+
+# TTL for routes whose data moves with every snapshot sync
+RESPONSE_CACHE_SHORT_TTL = float(os.environ.get('RESPONSE_CACHE_SHORT_TTL', 60))
+
+# Entries are recomputed once this fraction of their TTL has passed
+RESPONSE_REFRESH_AHEAD = float(os.environ.get('RESPONSE_REFRESH_AHEAD', 0.75))
+
+# Seconds between refresher sweeps
+RESPONSE_REFRESH_INTERVAL = float(os.environ.get('RESPONSE_REFRESH_INTERVAL', 5))
+
+# Entries nobody has read for this many seconds are dropped (warmed ones are kept)
+RESPONSE_CACHE_IDLE = float(os.environ.get('RESPONSE_CACHE_IDLE', 3600))
+
+# Entries kept for the time-range routes; the least recently read go first
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 256))
+
+# Last good responses kept for the routes without a time range
+RESPONSE_FALLBACK_MAX_ENTRIES = int(os.environ.get('RESPONSE_FALLBACK_MAX_ENTRIES', 256))
+
+# Cached bodies at least this large are also stored gzip (and brotli) compressed
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', 1024))
+
+# Compression effort; entries are compressed once per refresh, off the request path
+RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', 6))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', 5))
+
+# Set on responses served past their TTL or while the upstream circuit is open
+STALE_HEADER = 'X-Data-Stale'
+
+# created is wall-clock time so workers can compare entries; etag hashes
+# the body; modified is when that body last changed;
+# encoded maps a content coding ('br', 'gzip') to the compressed body
+CachedResponse = namedtuple('CachedResponse', ['body', 'status', 'mimetype', 'created', 'window',
+                                               'etag', 'modified', 'encoded'])
+
+_Route = namedtuple('_Route', ['view', 'param', 'ttl', 'warm', 'cache_control'])
+
+
+def cache_control(max_age=0):
+    """Cache-Control for a cached payload: browsers may reuse it for max_age
+    seconds, then revalidate with its ETag"""
+    return f'public, max-age={int(max_age)}' if max_age > 0 else 'no-cache'
+
+
+def _compress(body):
+    """{content coding: compressed body} for a body worth compressing, best coding first"""
+    if len(body) < RESPONSE_COMPRESS_MIN_BYTES:
+        return {}
+    encoded = {}
+    if brotli is not None:
+        encoded['br'] = brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    # mtime=0 keeps the gzip bytes identical for identical bodies
+    encoded['gzip'] = gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+    return {coding: data for coding, data in encoded.items() if len(data) < len(body)}
+
+
+def _entry(response, window, previous=None, compress=False):
+    body = response.get_data()
+    etag = hashlib.sha1(body).hexdigest()[:20]
+    unchanged = previous is not None and previous.etag == etag
+    # A refresh that produced the same bytes keeps the old validators
+    modified = previous.modified if unchanged else datetime.now(timezone.utc).replace(microsecond=0)
+    if not compress:
+        encoded = {}
+    elif unchanged and previous.encoded:
+        encoded = previous.encoded
+    else:
+        encoded = _compress(body)
+    return CachedResponse(body, response.status_code, response.mimetype, time.time(), window, etag,
+                          modified, encoded)
+
+
+class ResponseCache:
+    """Responses of the time-range routes, keyed by route and canonical window
+
+    Keys use the window's canonical time_range ('15', 'all', '0.5'), so an
+    entry survives window buckets rolling over. A background thread warms
+    every route's dashboard ranges at startup and recomputes entries before
+    their TTL runs out, so readers are answered from memory; only a range
+    nobody has asked for yet is computed inline.
+
+    A response computed while any query went unanswered (an upstream error
+    or an open circuit breaker) never replaces a good entry, so during an
+    incident readers keep getting the last good payload, marked stale.
+
+    Served payloads carry an ETag and Last-Modified that only change when
+    the body does, and conditional requests that still match get a 304.
+    Large bodies are compressed once when cached and sent as stored to
+    clients that accept br or gzip.
+
+    With SHARED_CACHE=1 every entry is also published to shared_cache, and
+    workers adopt each other's entries instead of recomputing them.
+    """
+
+    def __init__(self, interval=RESPONSE_REFRESH_INTERVAL, refresh_ahead=RESPONSE_REFRESH_AHEAD,
+                 idle=RESPONSE_CACHE_IDLE, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.app = None
+        self.interval = interval
+        self.refresh_ahead = refresh_ahead
+        self.idle = idle
+        self.max_entries = max_entries
+        self._routes = {}
+        self._entries = OrderedDict()
+        self._last_read = {}
+        self._last_good = OrderedDict()
+        self._key_locks = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        self.app = app
+
+    def cached(self, param, ttl=RESPONSE_CACHE_TTL, warm=(), max_age=0):
+        """Decorator for a view taking a single time range argument named param
+
+        Browsers may reuse the response for max_age seconds without asking.
+        """
+        def decorate(view):
+            name = view.__name__
+            self._routes[name] = _Route(view, param, ttl, tuple(warm), cache_control(max_age))
+
+            @wraps(view)
+            def wrapper(**kwargs):
+                if not RESPONSE_CACHE_ENABLED:
+                    return view(**kwargs)
+                try:
+                    # Canonical ranges need no query, so an 'all' entry is still
+                    # served while the oldest order time can't be read
+                    key = (name, canonical_range(kwargs[param]))
+                except ValueError:
+                    # Let the view answer invalid ranges itself
+                    return view(**kwargs)
+
+                with self._lock:
+                    self._last_read[key] = time.monotonic()
+                    entry = self._entries.get(key)
+                    if entry is not None:
+                        self._entries.move_to_end(key)
+                if entry is None:
+                    entry, response = self._fill(key)
+                    if entry is None:
+                        return response
+                elif time.time() - entry.created >= ttl:
+                    # The refresher is behind; serve this copy and refresh it aside
+                    self._refresh_async(key, entry.created)
+                return self._response(entry, ttl, self._routes[name].cache_control)
+            return wrapper
+        return decorate
+
+    def fallback(self, view):
+        """Decorator for other JSON views: serve their last good response while upstream is failing"""
+        name = view.__name__
+
+        @wraps(view)
+        def wrapper(**kwargs):
+            if not RESPONSE_CACHE_ENABLED:
+                return view(**kwargs)
+            key = (name, request.full_path)
+            good = self._last_good.get(key)
+            if good is not None and circuit_breaker.is_open:
+                return self._response(good, 0, cache_control())
+
+            with unanswered_queries() as missed:
+                response = self.app.make_response(view(**kwargs))
+            if response.status_code == 200 and not missed:
+                good = _entry(response, None, good)
+                with self._lock:
+                    self._last_good[key] = good
+                    self._last_good.move_to_end(key)
+                    while len(self._last_good) > RESPONSE_FALLBACK_MAX_ENTRIES:
+                        self._last_good.popitem(last=False)
+                return self._response(good, float('inf'), cache_control())
+            if good is not None:
+                return self._response(good, 0, cache_control())
+            return response
+        return wrapper
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def _fill(self, key, force=False, seen=None):
+        """Compute and store one entry; returns (entry, None) or (None, uncacheable response)
+
+        A forced refresh passes the created time of the copy it found due as
+        seen (None if there was none), and stops if that copy was replaced
+        while it waited for the key.
+        """
+        name, time_range = key
+        route = self._routes[name]
+        # One thread, and with a shared cache one worker, computes each entry
+        with self._key_lock(key), shared_cache.lock(('response',) + key):
+            entry = self._entries.get(key)
+            if force and entry is not None and (seen is None or entry.created > seen):
+                # Another thread refreshed it while we waited
+                return entry, None
+            shared = shared_cache.get(('response',) + key)
+            # A refresh only takes one that isn't due itself; a first read takes
+            # one within its TTL, or any age while upstream is failing
+            fresh_for = route.ttl * self.refresh_ahead if force else \
+                (float('inf') if circuit_breaker.is_open else route.ttl)
+            if shared is not None and (entry is None or shared.created > entry.created) and \
+                    time.time() - shared.created < fresh_for:
+                # Another worker computed it recently enough
+                self._store(key, shared)
+                return shared, None
+            if entry is not None and not force:
+                # Another reader filled it while we waited
+                return entry, None
+
+            with unanswered_queries() as missed, self.app.test_request_context():
+                response = self.app.make_response(route.view(**{route.param: time_range}))
+            if response.status_code != 200:
+                return None, response
+            if missed:
+                # Some query went unanswered, so this payload may be partial or
+                # zeroed; keep the last good copy if there is one
+                print(f"Not caching {name}/{time_range}: upstream queries failed")
+                return entry, (None if entry is not None else response)
+            try:
+                window = resolve_window(time_range)
+            except OldestTimeUnavailable:
+                print(f"Not caching {name}/{time_range}: window unavailable")
+                return entry, (None if entry is not None else response)
+            entry = _entry(response, window, entry, compress=True)
+            self._store(key, entry)
+            # Kept past its TTL so a worker starting during an outage still has a copy
+            shared_cache.set(('response',) + key, entry, max(route.ttl, self.idle))
+            return entry, None
+
+    def _store(self, key, entry):
+        warm = set(self._warm_keys())
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            # Evict the least recently read entries, never a warm range
+            evict = [old for old in self._entries if old not in warm]
+            for old in evict[:max(len(self._entries) - self.max_entries, 0)]:
+                self._drop(old)
+
+    def _drop(self, key):
+        # Callers hold self._lock
+        self._entries.pop(key, None)
+        self._last_read.pop(key, None)
+        self._key_locks.pop(key, None)
+
+    def _refresh_async(self, key, seen):
+        # Marked before the thread starts, so a burst of reads starts one refresh
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(target=self._refresh_aside, args=(key, seen), daemon=True).start()
+
+    def _refresh_aside(self, key, seen):
+        try:
+            self._refresh(key, seen)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _refresh(self, key, seen=None):
+        try:
+            # A refresh re-queries upstream, so the entry's age is the data's age
+            with bulk_queries(), fresh_queries():
+                entry, response = self._fill(key, force=True, seen=seen)
+            if entry is None and response.status_code != 200:
+                # Keep serving the last good copy
+                print(f"Refreshing {key[0]}/{key[1]} returned {response.status_code}")
+        except Exception as e:
+            print(f"Error refreshing {key[0]}/{key[1]}: {str(e)}")
+
+    def _response(self, entry, ttl, cache_control):
+        coding = request.accept_encodings.best_match(entry.encoded) if entry.encoded else None
+        if coding is None:
+            response = self.app.response_class(entry.body, status=entry.status, mimetype=entry.mimetype)
+            response.set_etag(entry.etag)
+        else:
+            response = self.app.response_class(entry.encoded[coding], status=entry.status, mimetype=entry.mimetype)
+            response.headers['Content-Encoding'] = coding
+            # Each representation needs its own validator
+            response.set_etag(f'{entry.etag}-{coding}')
+        if entry.encoded:
+            response.vary.add('Accept-Encoding')
+        response.last_modified = entry.modified
+        response.headers['Cache-Control'] = cache_control
+        age = time.time() - entry.created
+        response.headers['Age'] = str(int(age))
+        if age >= ttl or circuit_breaker.is_open:
+            response.headers[STALE_HEADER] = 'true'
+        # Turns into a bodyless 304 when If-None-Match / If-Modified-Since still match
+        return response.make_conditional(request)
+
+    def _warm_keys(self):
+        keys = []
+        for name, route in self._routes.items():
+            try:
+                keys.extend((name, canonical_range(time_range)) for time_range in route.warm)
+            except ValueError as e:
+                print(f"Skipping warm ranges of {name}: {str(e)}")
+        return keys
+
+    def warm(self):
+        """Compute every route's warm ranges that are not cached yet"""
+        started = time.monotonic()
+        for key in self._warm_keys():
+            if key not in self._entries:
+                self._refresh(key)
+        print(f"Response cache warmed {len(self._entries)} entries in {time.monotonic() - started:.2f}s")
+
+    def refresh_due(self):
+        """Recompute entries close to expiry, drop ones nobody reads any more and
+        retry warm ranges that failed earlier
+
+        Only warm ranges and entries read within their TTL are refreshed ahead;
+        any other entry is refreshed when it is next read past its TTL.
+        """
+        now = time.monotonic()
+        warm = set(self._warm_keys())
+        for key in warm.difference(self._entries):
+            self._refresh(key)
+        with self._lock:
+            entries = list(self._entries.items())
+        for key, entry in entries:
+            ttl = self._routes[key[0]].ttl
+            idle = now - self._last_read.get(key, 0)
+            if key not in warm and idle > self.idle:
+                with self._lock:
+                    self._drop(key)
+                continue
+            if (key in warm or idle <= ttl) and time.time() - entry.created >= ttl * self.refresh_ahead:
+                self._refresh(key, entry.created)
+
+    def _run(self):
+        try:
+            self.warm()
+        except Exception as e:
+            print(f"Error warming response cache: {str(e)}")
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh_due()
+            except Exception as e:
+                print(f"Error refreshing response cache: {str(e)}")
+
+    def start(self):
+        """Start the warm-up and refresh thread for this process (idempotent)"""
+        if not RESPONSE_CACHE_ENABLED or self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # Threads don't survive a fork, so each gunicorn worker starts its own
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='response-cache', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._last_read.clear()
+
+
+response_cache = ResponseCache()
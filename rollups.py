@@ -0,0 +1,853 @@
+import os
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from addresses import NULL_ID, address_table
+from sketches import SKETCH_PRECISION, HyperLogLog, hash_values, register_updates
+from snapshot import _datetime64, volume_snapshot
+
+
+SIDES = ('source', 'dest')
+
+# Assets the dashboard's asset charts never show
+EXCLUDED_ASSETS = ('usualx', '0', 'O', '')
+
+# How the RPC renders date_trunc('day', block_timestamp), a naive UTC timestamp
+DAY_TIMESTAMP_FORMAT = '%Y-%m-%dT00:00:00'
+
+
+class _Categories:
+    """Stable value -> code mapping that only ever grows"""
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        return self._codes.get(value)
+
+    def codes(self, values):
+        local, uniques = pd.factorize(values, use_na_sentinel=False)
+        lookup = np.empty(len(uniques), dtype=np.int64)
+        for i, value in enumerate(uniques):
+            key = None if pd.isna(value) else value
+            code = self._codes.get(key)
+            if code is None:
+                code = self._codes[key] = len(self.values)
+                self.values.append(key)
+            lookup[i] = code
+        return lookup[local]
+
+
+CubeState = namedtuple('CubeState', ['first_day', 'assets', 'chains', 'volume', 'trades',
+                                     'running_volume', 'running_trades'])
+
+
+def side_rows(columns):
+    """Unpivot snapshot columns into one (day, asset, chain, side, volume) row per side"""
+    days = columns['block_timestamp'].astype('datetime64[D]')
+    return pd.concat([
+        pd.DataFrame({
+            'day': days,
+            'asset': columns[f'{side}_id'],
+            'chain': columns[f'{side}_chain'],
+            'side': side,
+            'volume': columns[f'{side}_volume'],
+        })
+        for side in SIDES
+    ], ignore_index=True)
+
+
+class VolumeCube:
+    """Volume and row counts summed by day x asset x chain x side
+
+    Built from the volume snapshot and updated on every sync: only days at
+    or after the sync's lower bound are recomputed. Each update swaps in a
+    new CubeState, so readers never see a half-applied sync.
+
+    The state also keeps running totals by asset and chain (entry d sums
+    the days before d), so any window's totals are a single subtraction.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.ready = threading.Event()
+        self._state = None
+        self._assets = _Categories()
+        self._chains = _Categories()
+        snapshot.subscribe(self.on_sync)
+
+    def _aggregate(self, columns, first_day, n_days):
+        days = (columns['block_timestamp'].astype('datetime64[D]') - first_day).astype(np.int64)
+        codes = [(self._assets.codes(columns[f'{side}_id']), self._chains.codes(columns[f'{side}_chain']))
+                 for side in SIDES]
+        shape = (n_days, len(self._assets), len(self._chains), len(SIDES))
+        size = int(np.prod(shape))
+        volume = np.zeros(size)
+        trades = np.zeros(size, dtype=np.int64)
+        for side_code, (side, (assets, chains)) in enumerate(zip(SIDES, codes)):
+            flat = np.ravel_multi_index((days, assets, chains, np.full(len(days), side_code)), shape)
+            volume += np.bincount(flat, weights=columns[f'{side}_volume'], minlength=size)
+            trades += np.bincount(flat, minlength=size)
+        return volume.reshape(shape), trades.reshape(shape)
+
+    def on_sync(self, snapshot, since):
+        state = self._state
+        since_day = np.datetime64(since, 'D')
+        if state is None or not state.first_day <= since_day <= state.first_day + len(state.volume):
+            columns = snapshot.columns()
+            if not len(columns['block_timestamp']):
+                return
+            first_day = columns['block_timestamp'][0].astype('datetime64[D]')
+            kept_days = 0
+        else:
+            columns = snapshot.columns(start=since_day)
+            first_day = state.first_day
+            kept_days = int((since_day - first_day).astype(np.int64))
+
+        tail_first = first_day + kept_days
+        tail_last = columns['block_timestamp'][-1].astype('datetime64[D]') if len(columns['block_timestamp']) else tail_first
+        if state is not None:
+            tail_last = max(tail_last, state.first_day + len(state.volume) - 1)
+        n_tail = int((tail_last - tail_first).astype(np.int64)) + 1
+        tail_volume, tail_trades = self._aggregate(columns, tail_first, n_tail)
+
+        # Days before since are unchanged; carry them over into the (possibly wider) new cube
+        shape = (kept_days + n_tail,) + tail_volume.shape[1:]
+        volume = np.zeros(shape)
+        trades = np.zeros(shape, dtype=np.int64)
+        volume[kept_days:] = tail_volume
+        trades[kept_days:] = tail_trades
+        running_volume = np.zeros((len(volume) + 1,) + shape[1:3])
+        running_trades = np.zeros(running_volume.shape, dtype=np.int64)
+        if kept_days:
+            _, assets, chains, _ = state.volume.shape
+            volume[:kept_days, :assets, :chains] = state.volume[:kept_days]
+            trades[:kept_days, :assets, :chains] = state.trades[:kept_days]
+            running_volume[:kept_days + 1, :assets, :chains] = state.running_volume[:kept_days + 1]
+            running_trades[:kept_days + 1, :assets, :chains] = state.running_trades[:kept_days + 1]
+        running_volume[kept_days + 1:] = running_volume[kept_days] + np.cumsum(tail_volume.sum(axis=3), axis=0)
+        running_trades[kept_days + 1:] = running_trades[kept_days] + np.cumsum(tail_trades.sum(axis=3), axis=0)
+
+        self._state = CubeState(first_day, np.array(self._assets.values, dtype=object),
+                                np.array(self._chains.values, dtype=object), volume, trades,
+                                running_volume, running_trades)
+        self.ready.set()
+
+    def _window_offset(self, state, start):
+        """(index of the first whole day at or after start, partial first day or None)"""
+        if start is None:
+            return 0, None
+        start = pd.Timestamp(start).to_datetime64().astype('datetime64[us]')
+        start_day = start.astype('datetime64[D]')
+        offset = max(0, int((start_day - state.first_day).astype(np.int64)))
+        if start > start_day and start_day >= state.first_day:
+            return offset + 1, (start, start_day + 1)
+        return offset, None
+
+    def cells(self, start=None):
+        """Return the non-empty cells at or after start as a long DataFrame
+
+        Columns are day (datetime64[D]), asset, chain, side, volume and trades.
+        Whole days come from the cube; a start part-way through a day is
+        answered for that day from the snapshot's rows.
+        """
+        state = self._state
+        if state is None:
+            return pd.DataFrame(columns=['day', 'asset', 'chain', 'side', 'volume', 'trades'])
+
+        offset, partial_day = self._window_offset(state, start)
+        partial = None
+        if partial_day is not None:
+            rows = side_rows(self.snapshot.columns(*partial_day))
+            partial = rows.groupby(['day', 'asset', 'chain', 'side'], as_index=False, dropna=False).agg(
+                volume=('volume', 'sum'), trades=('volume', 'size'))
+
+        days, assets, chains, sides = np.nonzero(state.trades[offset:])
+        cells = pd.DataFrame({
+            'day': state.first_day + offset + days,
+            'asset': state.assets[assets],
+            'chain': state.chains[chains],
+            'side': np.array(SIDES, dtype=object)[sides],
+            'volume': state.volume[offset:][days, assets, chains, sides],
+            'trades': state.trades[offset:][days, assets, chains, sides],
+        })
+        if partial is not None and len(partial):
+            cells = pd.concat([partial, cells], ignore_index=True)
+        return cells
+
+    def totals(self, start=None):
+        """Volume and trades by asset and chain at or after start, both sides summed
+
+        Returns a long DataFrame with columns asset, chain, volume and trades,
+        read off the running totals instead of scanning the window's days.
+        """
+        state = self._state
+        if state is None:
+            return pd.DataFrame(columns=['asset', 'chain', 'volume', 'trades'])
+
+        offset, partial_day = self._window_offset(state, start)
+        offset = min(offset, len(state.volume))
+        volume = state.running_volume[-1] - state.running_volume[offset]
+        trades = state.running_trades[-1] - state.running_trades[offset]
+        assets, chains = np.nonzero(trades)
+        totals = pd.DataFrame({
+            'asset': state.assets[assets],
+            'chain': state.chains[chains],
+            'volume': volume[assets, chains],
+            'trades': trades[assets, chains],
+        })
+        if partial_day is not None:
+            rows = side_rows(self.snapshot.columns(*partial_day))
+            if len(rows):
+                partial = rows.groupby(['asset', 'chain'], as_index=False, dropna=False).agg(
+                    volume=('volume', 'sum'), trades=('volume', 'size'))
+                totals = pd.concat([partial, totals], ignore_index=True).groupby(
+                    ['asset', 'chain'], as_index=False, dropna=False, sort=False)[['volume', 'trades']].sum()
+        return totals
+
+
+Ranking = namedtuple('Ranking', ['volume', 'other'])
+
+
+class AssetRanking:
+    """Top-K assets by volume per window, shared by every asset chart
+
+    Window totals come from the cube's running totals, and each ranking is
+    kept until the next cube update, so routes asking about the same window
+    (weekly, histogram, pie, cumulative, get_assets) reuse one answer.
+    """
+
+    def __init__(self, cube):
+        self.cube = cube
+        self._state = None
+        self._totals = {}
+        self._rankings = {}
+        self._lock = threading.Lock()
+
+    def _current(self):
+        state = self.cube._state
+        if state is not self._state:
+            with self._lock:
+                if state is not self._state:
+                    self._totals = {}
+                    self._rankings = {}
+                    self._state = state
+        return self._totals, self._rankings
+
+    def totals(self, start=None):
+        """The cube's asset x chain totals for the window starting at start"""
+        totals, _ = self._current()
+        key = None if start is None else _datetime64(start)
+        window = totals.get(key)
+        if window is None:
+            window = totals[key] = self.cube.totals(start)
+        return window
+
+    def top(self, start=None, n=14, excluded=EXCLUDED_ASSETS, excluded_chains=()):
+        """Ranking(volume, other) for the window starting at start
+
+        volume is a Series of the n assets with the most volume (excluded
+        assets never rank), largest first; other is the volume of everything
+        else left after the chain and asset exclusions. As in the SQL, NULL
+        drops out with any exclusion list and otherwise takes its place in
+        the ranking but is counted in other.
+        """
+        _, rankings = self._current()
+        key = (None if start is None else _datetime64(start), n, tuple(excluded), tuple(excluded_chains))
+        ranking = rankings.get(key)
+        if ranking is not None:
+            return ranking
+
+        totals = self.totals(start)
+        if excluded_chains:
+            # Like SQL's NOT IN, which never matches a NULL chain
+            totals = totals[totals['chain'].notna() & ~totals['chain'].isin(excluded_chains)]
+        if excluded:
+            totals = totals[totals['asset'].notna() & ~totals['asset'].isin(excluded)]
+        by_asset = totals.groupby('asset', dropna=False)['volume'].sum()
+        volume = by_asset.nlargest(n)
+        volume = volume[volume.index.notna()]
+        ranking = rankings[key] = Ranking(volume, float(totals['volume'].sum() - volume.sum()))
+        return ranking
+
+
+def _valid_assets(cells, excluded=EXCLUDED_ASSETS):
+    return cells[cells['asset'].notna() & ~cells['asset'].isin(excluded)]
+
+
+def _daily_series(cells, assets, days):
+    daily = cells[cells['asset'].isin(assets)].pivot_table(
+        index='day', columns='asset', values='volume', aggfunc='sum')
+    return daily.reindex(index=days, columns=assets).fillna(0)
+
+
+def _long(daily, **columns):
+    frame = pd.DataFrame({
+        'day': np.repeat(daily.index.strftime('%Y-%m-%d'), len(daily.columns)),
+        'asset': np.tile(daily.columns.to_numpy(dtype=object), len(daily.index)),
+    })
+    for name, values in columns.items():
+        frame[name] = values.to_numpy().ravel()
+    return frame.sort_values(['day', 'asset'], kind='stable', ignore_index=True)
+
+
+def chain_asset_volume(start, top_n=14, excluded=None):
+    """Volume by chain and asset, assets outside the top_n grouped as 'Other'"""
+    excluded = tuple(excluded or ())
+    totals = asset_ranking.totals(start)
+    if excluded:
+        # Like SQL's NOT IN, which never matches NULL chains or assets
+        totals = totals[totals['chain'].notna() & ~totals['chain'].isin(excluded) &
+                        totals['asset'].notna() & ~totals['asset'].isin(excluded)]
+    top = asset_ranking.top(start, top_n, excluded=excluded, excluded_chains=excluded).volume.index
+    totals = totals.assign(asset=totals['asset'].where(totals['asset'].isin(top), 'Other'))
+    volume = totals.groupby(['chain', 'asset'], as_index=False, dropna=False)['volume'].sum()
+    return volume.sort_values('volume', ascending=False, ignore_index=True)
+
+
+def daily_asset_volume(start, top_n=14):
+    """Daily and running volume of the window's top assets (get_weekly_volume/<time_range>)"""
+    cells = _valid_assets(volume_cube.cells(start))
+    if cells.empty:
+        return pd.DataFrame(columns=['day', 'asset', 'daily_volume', 'cumulative_volume'])
+    top = asset_ranking.top(start, top_n).volume.index
+    daily = _daily_series(cells, top, pd.date_range(cells['day'].min(), cells['day'].max()))
+    return _long(daily, daily_volume=daily, cumulative_volume=daily.cumsum())
+
+
+def cumulative_asset_volume(start, top_n=14):
+    """Running volume of the all-time top assets over the window (cumulative_data)"""
+    top = asset_ranking.top(None, top_n).volume.index
+    cells = volume_cube.cells(start)
+    if cells.empty:
+        return pd.DataFrame(columns=['day', 'asset', 'cumulative_volume'])
+    daily = _daily_series(cells, top, pd.date_range(cells['day'].min(), cells['day'].max()))
+    return _long(daily, cumulative_volume=daily.cumsum())
+
+
+def daily_volume_by(start, column, excluded):
+    """Volume per day and chain or asset, oldest day first (get_mach_*_volume)"""
+    cells = volume_cube.cells(start)
+    cells = cells[cells[column].notna() & ~cells[column].isin(excluded)]
+    volume = cells.groupby([column, 'day'], as_index=False)['volume'].sum()
+    volume = volume.sort_values(['day', 'volume'], ascending=[True, False], ignore_index=True)
+    return pd.DataFrame({
+        column: volume[column],
+        'day': volume['day'].dt.strftime(DAY_TIMESTAMP_FORMAT),
+        'total_volume': volume['volume'],
+    })
+
+
+volume_cube = VolumeCube(volume_snapshot)
+asset_ranking = AssetRanking(volume_cube)
+
+
+# Hours of history kept in the hourly ring buffer
+HOURLY_RING_DAYS = int(os.environ.get('HOURLY_RING_DAYS', 90))
+
+_HOUR = np.timedelta64(1, 'h')
+
+_NO_WALLETS = np.empty(0, dtype=np.int32)
+
+
+def _hour_numbers(timestamps):
+    return timestamps.astype('datetime64[h]').astype(np.int64)
+
+
+def _hour_totals(columns, first_hour, n_hours):
+    """Per-hour totals for rows in hours [first_hour, first_hour + n_hours)"""
+    hours = _hour_numbers(columns['block_timestamp']) - first_hour
+    source = columns['source_volume']
+    dest = columns['dest_volume']
+    positive = (source > 0) | (dest > 0)
+    totals = {
+        'rows': np.bincount(hours, minlength=n_hours),
+        'total_volume': np.bincount(hours, weights=columns['total_volume'], minlength=n_hours),
+        # short_term_data only counts sides with volume > 0
+        'positive_volume': np.bincount(hours, weights=np.where(source > 0, source, 0) + np.where(dest > 0, dest, 0),
+                                       minlength=n_hours),
+        'positive_rows': np.bincount(hours, weights=positive, minlength=n_hours).astype(np.int64),
+        'tx_count': np.zeros(n_hours, dtype=np.int64),
+        'wallets': [_NO_WALLETS] * n_hours,
+    }
+    if positive.any():
+        trades = pd.DataFrame({
+            'hour': hours[positive],
+            'transaction_hash': columns['transaction_hash'][positive],
+            'wallet': columns['sender_address_id'][positive],
+        })
+        # A transaction lives in a single block, so distinct counts add up across hours
+        tx_count = trades.groupby('hour')['transaction_hash'].nunique()
+        totals['tx_count'][tx_count.index] = tx_count.to_numpy()
+        wallets = trades[trades['wallet'] != NULL_ID].drop_duplicates(['hour', 'wallet'])
+        for hour, ids in wallets.groupby('hour')['wallet']:
+            totals['wallets'][hour] = ids.to_numpy()
+    return totals
+
+
+def _asset_mask(columns, asset):
+    return (columns['source_id'] == asset) | (columns['dest_id'] == asset)
+
+
+class HourlyRing:
+    """Fixed-size ring of hourly buckets covering the last HOURLY_RING_DAYS days
+
+    Each slot holds one hour's row count, volume, distinct trade count,
+    distinct wallets and per-asset volume. Syncs rewrite only the hours
+    they touch (normally just the current one), and older hours roll off
+    as their slots are reused.
+    """
+
+    def __init__(self, snapshot, days=HOURLY_RING_DAYS):
+        self.snapshot = snapshot
+        self.capacity = days * 24
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+        self._assets = _Categories()
+        self._first_hour = None
+        self._latest_hour = None
+        self._hours = np.full(self.capacity, -1, dtype=np.int64)
+        self._totals = {
+            'rows': np.zeros(self.capacity, dtype=np.int64),
+            'total_volume': np.zeros(self.capacity),
+            'positive_volume': np.zeros(self.capacity),
+            'positive_rows': np.zeros(self.capacity, dtype=np.int64),
+            'tx_count': np.zeros(self.capacity, dtype=np.int64),
+            'wallets': [_NO_WALLETS] * self.capacity,
+        }
+        # Volume and row count of rows touching each asset on either side, counted once per row
+        self._asset_volume = np.zeros((self.capacity, 0))
+        self._asset_rows = np.zeros((self.capacity, 0), dtype=np.int64)
+        snapshot.subscribe(self.on_sync)
+
+    def _asset_totals(self, columns, first_hour, n_hours):
+        hours = _hour_numbers(columns['block_timestamp']) - first_hour
+        source = self._assets.codes(columns['source_id'])
+        dest = self._assets.codes(columns['dest_id'])
+        width = len(self._assets)
+        size = n_hours * width
+        other_side = dest != source
+        volume = (np.bincount(hours * width + source, weights=columns['total_volume'], minlength=size)
+                  + np.bincount(hours * width + dest, weights=columns['total_volume'] * other_side, minlength=size))
+        rows = (np.bincount(hours * width + source, minlength=size)
+                + np.bincount(hours * width + dest, weights=other_side, minlength=size).astype(np.int64))
+        return volume.reshape(n_hours, width), rows.reshape(n_hours, width)
+
+    def on_sync(self, snapshot, since):
+        timestamps = snapshot.columns(names=['block_timestamp'])['block_timestamp']
+        if not len(timestamps):
+            return
+        latest_hour = int(_hour_numbers(timestamps[-1]))
+        first_hour = max(int(_hour_numbers(_datetime64(since))), latest_hour - self.capacity + 1)
+        n_hours = latest_hour - first_hour + 1
+
+        columns = snapshot.columns(start=np.datetime64(first_hour, 'h'))
+        totals = _hour_totals(columns, first_hour, n_hours)
+        asset_volume, asset_rows = self._asset_totals(columns, first_hour, n_hours)
+        hours = np.arange(first_hour, latest_hour + 1)
+        slots = hours % self.capacity
+
+        with self._lock:
+            width = asset_volume.shape[1]
+            grow = width - self._asset_volume.shape[1]
+            if grow > 0:
+                self._asset_volume = np.pad(self._asset_volume, ((0, 0), (0, grow)))
+                self._asset_rows = np.pad(self._asset_rows, ((0, 0), (0, grow)))
+            self._hours[slots] = hours
+            for name, values in totals.items():
+                if name == 'wallets':
+                    for slot, wallets in zip(slots, values):
+                        self._totals[name][slot] = wallets
+                else:
+                    self._totals[name][slots] = values
+            self._asset_volume[slots] = 0
+            self._asset_rows[slots] = 0
+            self._asset_volume[slots, :width] = asset_volume
+            self._asset_rows[slots, :width] = asset_rows
+            self._first_hour = int(_hour_numbers(timestamps[0]))
+            self._latest_hour = latest_hour
+        self.ready.set()
+
+    def covers(self, start):
+        """Whether every hour from start onwards is held in the ring"""
+        if self._latest_hour is None:
+            return False
+        oldest = self._latest_hour - self.capacity + 1
+        # Hours before the first row are trivially complete
+        return self._first_hour >= oldest or int(_hour_numbers(_datetime64(start))) >= oldest
+
+    def _partial(self, start, end, asset):
+        columns = self.snapshot.columns(start, end)
+        hour = int(_hour_numbers(start))
+        frame = pd.DataFrame(_hour_totals(columns, hour, 1))
+        if asset is not None:
+            touching = _asset_mask(columns, asset)
+            frame['asset_volume'] = columns['total_volume'][touching].sum()
+            frame['asset_rows'] = int(touching.sum())
+        frame['hour'] = np.datetime64(hour, 'h')
+        return frame
+
+    def window(self, start, end=None, asset=None):
+        """Hourly buckets for rows with start <= block_timestamp < end, oldest first
+
+        Columns are hour, rows, total_volume, positive_volume, positive_rows,
+        tx_count and wallets, plus asset_volume and asset_rows when asset is
+        given. Hours with no rows are left out; partial first and last hours
+        are summed from the snapshot's rows.
+        """
+        start = _datetime64(start)
+        end = None if end is None else _datetime64(end)
+        first_full = start.astype('datetime64[h]')
+        if first_full < start:
+            first_full += _HOUR
+        end_hour = None if end is None else end.astype('datetime64[h]')
+
+        with self._lock:
+            stop = self._latest_hour + 1
+            if end_hour is not None:
+                stop = min(stop, int(end_hour.astype(np.int64)))
+            hours = np.arange(int(first_full.astype(np.int64)), stop)
+            # Slots still holding an hour from a previous lap are outside the ring
+            hours = hours[self._hours[hours % self.capacity] == hours]
+            slots = hours % self.capacity
+            frame = pd.DataFrame({
+                name: [values[slot] for slot in slots] if name == 'wallets' else values[slots]
+                for name, values in self._totals.items()
+            })
+            if asset is not None:
+                code = self._assets.code(asset)
+                frame['asset_volume'] = self._asset_volume[slots, code] if code is not None else 0.0
+                frame['asset_rows'] = self._asset_rows[slots, code] if code is not None else 0
+        frame['hour'] = hours.astype('datetime64[h]')
+
+        parts = []
+        if start < first_full:
+            parts.append(self._partial(start, first_full if end is None else min(first_full, end), asset))
+        parts.append(frame)
+        if end_hour is not None and first_full <= end_hour < end:
+            parts.append(self._partial(end_hour, end, asset))
+        frame = pd.concat(parts, ignore_index=True)
+        rows = frame['asset_rows'] if asset is not None else frame['rows']
+        return frame[rows > 0].reset_index(drop=True)
+
+
+def _new_york_wall_time(values):
+    """Naive UTC timestamps as naive New York wall-clock times"""
+    return pd.DatetimeIndex(values).tz_localize('UTC').tz_convert('America/New_York').tz_localize(None)
+
+
+def hourly_total_volume():
+    """Volume per New York hour, as get_hourly_volume reports it"""
+    # NOW() AT TIME ZONE 'UTC' AT TIME ZONE 'America/New_York' reads UTC wall time as New York time
+    now = pd.Timestamp.utcnow().tz_localize(None)
+    end = now.tz_localize('America/New_York', ambiguous=False, nonexistent='shift_forward')
+    end = end.tz_convert('UTC').tz_localize(None)
+    buckets = hourly_ring.window(end - pd.Timedelta(hours=24), end)
+    volume = buckets.groupby(_new_york_wall_time(buckets['hour']))['total_volume'].sum()
+    return pd.DataFrame({
+        'hour': volume.index.strftime('%I %p'),
+        'total_hourly_volume': volume.to_numpy(),
+        'asset': 'Total',
+    })
+
+
+def hourly_asset_volume(asset):
+    """Hourly volume of trades touching asset over the last complete day"""
+    latest_day = pd.Timestamp(volume_snapshot.watermark).floor('D')
+    buckets = hourly_ring.window(latest_day - pd.Timedelta(days=1), latest_day, asset=asset)
+    return pd.DataFrame({
+        'hour': pd.DatetimeIndex(buckets['hour']).strftime('%I %p'),
+        'total_hourly_volume': buckets['asset_volume'],
+        'asset': asset,
+    })
+
+
+def cumulative_unique(wallet_lists):
+    """Running count of distinct wallets over a sequence of per-hour wallet lists
+
+    Lists may hold address strings (interned here) or address_table ids.
+    """
+    lengths = np.fromiter((len(wallets) for wallets in wallet_lists), dtype=np.int64, count=len(wallet_lists))
+    if not lengths.sum():
+        return np.zeros(len(lengths), dtype=np.int64)
+    wallets = np.concatenate([np.asarray(wallets) for wallets in wallet_lists if len(wallets)])
+    if wallets.dtype == object or wallets.dtype.kind == 'U':
+        wallets = address_table.intern(wallets)
+    hours = np.repeat(np.arange(len(lengths)), lengths)
+    valid = wallets != NULL_ID
+    # Each wallet counts from the first hour it shows up in
+    first_seen = np.full(len(address_table), len(lengths), dtype=np.int64)
+    np.minimum.at(first_seen, wallets[valid], hours[valid])
+    return np.cumsum(np.bincount(first_seen, minlength=len(lengths) + 1)[:len(lengths)])
+
+
+def short_term_hours(start):
+    """Hourly trade count, volume and wallets since start, as short_term_data reports them"""
+    buckets = hourly_ring.window(start)
+    buckets = buckets[buckets['positive_rows'] > 0]
+    return pd.DataFrame({
+        'hour': pd.DatetimeIndex(buckets['hour']).strftime('%Y-%m-%dT%H:%M:%S'),
+        'trades_count': buckets['tx_count'].to_numpy(),
+        'volume_total': buckets['positive_volume'].to_numpy(),
+        'wallets': buckets['wallets'],
+    })
+
+
+# Windows with at most this many rows count distinct users exactly
+METRICS_EXACT_ROWS = int(os.environ.get('METRICS_EXACT_ROWS', 100000))
+
+MetricsState = namedtuple('MetricsState', ['first_day', 'rows', 'total_volume', 'appearances', 'users', 'orders'])
+
+
+def _exact_metrics(columns):
+    addresses = np.concatenate([columns['sender_address_id'], columns['maker_address_id']])
+    counts = np.bincount(addresses[addresses != NULL_ID])
+    repeated_users = int(np.count_nonzero(counts > 1))
+    # Mirrors the SQL: COUNT(*) counts a repeated NULL address, COUNT(DISTINCT) doesn't
+    repeated = repeated_users + int(np.count_nonzero(addresses == NULL_ID) > 1)
+    return {
+        'users': int(np.count_nonzero(counts)),
+        'orders': int(pd.Series(columns['order_uuid'], dtype=object).nunique()),
+        'perc_above': repeated * 100.0 / repeated_users if repeated_users else 0.0,
+    }
+
+
+class DailyMetrics:
+    """Per-day volume, row counts and HyperLogLog sketches of users and orders
+
+    Distinct counts for a window merge the daily sketches (plus the
+    window's partial first day) instead of rescanning every address;
+    windows of up to METRICS_EXACT_ROWS rows are counted exactly.
+    """
+
+    def __init__(self, snapshot, precision=SKETCH_PRECISION):
+        self.snapshot = snapshot
+        self.precision = precision
+        self.ready = threading.Event()
+        self._state = None
+        snapshot.subscribe(self.on_sync)
+
+    def _sketch(self, days, hashes, n_days):
+        registers = np.zeros((n_days, 1 << self.precision), dtype=np.uint8)
+        index, rank = register_updates(hashes, self.precision)
+        np.maximum.at(registers, (days, index), rank)
+        return registers
+
+    def _aggregate(self, columns, first_day, n_days):
+        days = (columns['block_timestamp'].astype('datetime64[D]') - first_day).astype(np.int64)
+        senders = columns['sender_address_id'] != NULL_ID
+        makers = columns['maker_address_id'] != NULL_ID
+        orders = pd.notna(columns['order_uuid'])
+        # Hash the address strings, not the per-process ids
+        users = np.maximum(
+            self._sketch(days[senders], address_table.hashes(columns['sender_address_id'][senders]), n_days),
+            self._sketch(days[makers], address_table.hashes(columns['maker_address_id'][makers]), n_days))
+        appearances = (np.bincount(days, weights=senders, minlength=n_days)
+                       + np.bincount(days, weights=makers, minlength=n_days))
+        return {
+            'rows': np.bincount(days, minlength=n_days),
+            'total_volume': np.bincount(days, weights=columns['total_volume'], minlength=n_days),
+            'appearances': appearances.astype(np.int64),
+            'users': users,
+            'orders': self._sketch(days[orders], hash_values(columns['order_uuid'][orders]), n_days),
+        }
+
+    def on_sync(self, snapshot, since):
+        state = self._state
+        since_day = np.datetime64(since, 'D')
+        if state is None or not state.first_day <= since_day <= state.first_day + len(state.rows):
+            columns = snapshot.columns()
+            if not len(columns['block_timestamp']):
+                return
+            first_day = columns['block_timestamp'][0].astype('datetime64[D]')
+            kept_days = 0
+        else:
+            columns = snapshot.columns(start=since_day)
+            first_day = state.first_day
+            kept_days = int((since_day - first_day).astype(np.int64))
+
+        timestamps = columns['block_timestamp']
+        last_day = timestamps[-1].astype('datetime64[D]') if len(timestamps) else first_day + kept_days
+        n_tail = max(int((last_day - first_day).astype(np.int64)) + 1 - kept_days, 0)
+        tail = self._aggregate(columns, first_day + kept_days, n_tail)
+        fields = {
+            name: np.concatenate([getattr(state, name)[:kept_days], tail[name]]) if kept_days else tail[name]
+            for name in MetricsState._fields[1:]
+        }
+        self._state = MetricsState(first_day, **fields)
+        self.ready.set()
+
+    def metrics(self, start):
+        """get_metrics' figures for rows at or after start, or None if there are none"""
+        state = self._state
+        start = _datetime64(start)
+        start_day = start.astype('datetime64[D]')
+        offset = max(0, int((start_day - state.first_day).astype(np.int64)))
+
+        if state.rows[offset:].sum() <= METRICS_EXACT_ROWS:
+            columns = self.snapshot.columns(start)
+            if not len(columns['block_timestamp']):
+                return None
+            exact = _exact_metrics(columns)
+            users, orders, perc_above = exact['users'], exact['orders'], exact['perc_above']
+            total_volume = columns['total_volume'].sum()
+        else:
+            partial = None
+            if start > start_day and start_day >= state.first_day:
+                columns = self.snapshot.columns(start, start_day + 1)
+                partial = self._aggregate(columns, start_day, 1)
+                offset += 1
+            user_registers = state.users[offset:].max(axis=0, initial=0)
+            order_registers = state.orders[offset:].max(axis=0, initial=0)
+            total_volume = state.total_volume[offset:].sum()
+            appearances = state.appearances[offset:].sum()
+            if partial is not None:
+                user_registers = np.maximum(user_registers, partial['users'][0])
+                order_registers = np.maximum(order_registers, partial['orders'][0])
+                total_volume += partial['total_volume'].sum()
+                appearances += partial['appearances'].sum()
+            users = HyperLogLog(self.precision, user_registers).count()
+            orders = HyperLogLog(self.precision, order_registers).count()
+            # Someone trades more than once exactly when there are more appearances than users
+            perc_above = 100.0 if appearances > users else 0.0
+
+        if not users:
+            return None
+        now = np.datetime64(pd.Timestamp.utcnow().tz_localize(None), 'us')
+        last_day = self.snapshot.columns(max(start, now - np.timedelta64(24, 'h')), names=['total_volume'])
+        return {
+            'total_volume': float(total_volume),
+            'total_users': users,
+            'trade_count': orders,
+            'average_trades': round(orders / users),
+            'perc_above': perc_above,
+            'last_day_v': float(last_day['total_volume'].sum()),
+        }
+
+
+ActivityState = namedtuple('ActivityState', ['days', 'address_ids', 'appearances', 'trades', 'volume'])
+
+
+def _address_day_totals(columns):
+    """Per (day, address) appearances, trades and volume, counting sender and maker separately"""
+    days = np.tile(columns['block_timestamp'].astype('datetime64[D]'), 2)
+    address_ids = np.concatenate([columns['sender_address_id'], columns['maker_address_id']])
+    has_order = np.tile(pd.notna(columns['order_uuid']), 2)
+    volume = np.tile(columns['total_volume'], 2)
+    keys = days.astype(np.int64) << 32 | (address_ids.astype(np.int64) - NULL_ID)
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return ActivityState(
+        (keys >> 32).astype('datetime64[D]'),
+        ((keys & 0xFFFFFFFF) + NULL_ID).astype(np.int32),
+        np.bincount(inverse, minlength=len(keys)),
+        np.bincount(inverse, weights=has_order, minlength=len(keys)).astype(np.int64),
+        np.bincount(inverse, weights=volume, minlength=len(keys)),
+    )
+
+
+def _top(values, n):
+    """Indices of the n largest values, largest first (partial selection, then a small sort)"""
+    if len(values) > n:
+        top = np.argpartition(-values, n - 1)[:n]
+    else:
+        top = np.arange(len(values))
+    return top[np.argsort(-values[top], kind='stable')]
+
+
+class AddressActivity:
+    """Trade count and volume per address per day, for user_analysis
+
+    Rows are kept sorted by day, so a window is a slice plus one bincount
+    over dense address ids; top-N lists use partial selection instead of
+    sorting every address.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.ready = threading.Event()
+        self._state = None
+        snapshot.subscribe(self.on_sync)
+
+    def on_sync(self, snapshot, since):
+        since_day = np.datetime64(since, 'D')
+        state = self._state
+        if state is None:
+            self._state = _address_day_totals(snapshot.columns())
+        else:
+            keep = np.searchsorted(state.days, since_day, side='left')
+            tail = _address_day_totals(snapshot.columns(start=since_day))
+            self._state = ActivityState(*(np.concatenate([kept[:keep], new]) for kept, new in zip(state, tail)))
+        self.ready.set()
+
+    def totals(self, start):
+        """Per-address (appearances, trades, volume) arrays for rows at or after start
+
+        Index 0 is the NULL address; index i + 1 is address_table id i.
+        """
+        state = self._state
+        start = _datetime64(start)
+        first_full = start.astype('datetime64[D]')
+        parts = []
+        if first_full < start:
+            first_full += np.timedelta64(1, 'D')
+            parts.append(_address_day_totals(self.snapshot.columns(start, first_full)))
+        lo = np.searchsorted(state.days, first_full, side='left')
+        parts.append(ActivityState(*(values[lo:] for values in state)))
+
+        size = len(address_table) + 1
+        totals = [np.zeros(size, dtype=np.int64), np.zeros(size, dtype=np.int64), np.zeros(size)]
+        for part in parts:
+            index = part.address_ids.astype(np.int64) - NULL_ID
+            totals[0] += np.bincount(index, weights=part.appearances, minlength=size).astype(np.int64)
+            totals[1] += np.bincount(index, weights=part.trades, minlength=size).astype(np.int64)
+            totals[2] += np.bincount(index, weights=part.volume, minlength=size)
+        return totals
+
+    def rankings(self, start, top_n=200, rank_limit=300):
+        """user_analysis' trade_rank, volume_rank, trade_address and volume_address frames"""
+        appearances, trades, volume = self.totals(start)
+        present = np.flatnonzero(appearances)
+        trades, volume = trades[present], volume[present]
+        addresses = address_table.lookup(present.astype(np.int64) + NULL_ID)
+
+        # ROW_NUMBER() over trade count
+        top_trades = _top(trades.astype(np.float64), top_n)
+        total_trades = trades.sum()
+        trade_rank = pd.DataFrame({
+            'N': np.arange(1, len(top_trades) + 1),
+            'percentage_of_total_trades': np.cumsum(trades[top_trades]) * 100.0 / total_trades if total_trades else np.nan,
+        })
+
+        # RANK() over volume: ties share a rank, and the running sum includes every peer
+        top_volume = _top(volume, rank_limit)
+        ranked = volume[top_volume]
+        ranks = np.searchsorted(-ranked, -ranked, side='left') + 1
+        running = np.cumsum(ranked)[np.searchsorted(-ranked, -ranked, side='right') - 1]
+        total_volume = volume.sum()
+        volume_rank = pd.DataFrame({
+            'top_n': ranks,
+            'percentage_of_total_volume': running * 100.0 / total_volume if total_volume else np.nan,
+        })
+
+        trade_address = pd.DataFrame({
+            'address': addresses[top_trades],
+            'trade_count': trades[top_trades],
+        })
+        top_volume = top_volume[:top_n]
+        volume_address = pd.DataFrame({
+            'address': addresses[top_volume],
+            'total_user_volume': volume[top_volume],
+        })
+        return trade_rank, volume_rank, trade_address, volume_address
+
+
+daily_metrics = DailyMetrics(volume_snapshot)
+address_activity = AddressActivity(volume_snapshot)
+hourly_ring = HourlyRing(volume_snapshot)
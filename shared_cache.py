@@ -0,0 +1,200 @@
+import hashlib
+import os
+import pickle
+import stat
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Opt-in: share cached query results and responses between the worker
+# processes on one host through files in SHARED_CACHE_DIR
+SHARED_CACHE_ENABLED = os.environ.get('SHARED_CACHE', '0') == '1'
+
+# Defaults to tmpfs where there is one, so entries never touch disk. Must
+# be owned by, and writable only by, the user the app runs as
+SHARED_CACHE_DIR = os.environ.get('SHARED_CACHE_DIR', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), f'mach-dashboard-cache-{os.getuid()}'))
+
+# Values larger than this are kept per worker only
+SHARED_CACHE_MAX_VALUE_BYTES = int(os.environ.get('SHARED_CACHE_MAX_VALUE_BYTES', 64 * 1024 * 1024))
+
+# Seconds between sweeps removing expired entries and unused lock files
+SHARED_CACHE_PRUNE_INTERVAL = float(os.environ.get('SHARED_CACHE_PRUNE_INTERVAL', 60))
+
+# Lock files untouched for this long are removed by the sweep
+_LOCK_IDLE = 3600
+
+
+class SharedCache:
+    """TTL cache shared by the processes on one host, one file per entry
+
+    An entry is pickled to a temporary file which is then renamed over the
+    entry's path, so readers see either the old value or the new one, never
+    a partial write. The file's mtime holds the expiry time. lock(key) is an
+    flock per key, so only one worker computes a missing entry while the
+    others wait and read what it published.
+    """
+
+    def __init__(self, directory=SHARED_CACHE_DIR, enabled=SHARED_CACHE_ENABLED,
+                 max_value_bytes=SHARED_CACHE_MAX_VALUE_BYTES, prune_interval=SHARED_CACHE_PRUNE_INTERVAL):
+        self.directory = directory
+        self.enabled = enabled
+        self.max_value_bytes = max_value_bytes
+        self.prune_interval = prune_interval
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._last_prune = 0
+        self._prune_lock = threading.Lock()
+        if enabled and not self._secure_directory():
+            self.enabled = False
+
+    def _secure_directory(self):
+        """Create the cache directory for this user only; refuse one anyone else controls
+
+        Entries are unpickled, so a directory another local user can write to
+        would let them run code in this process.
+        """
+        for path in (self.directory, os.path.join(self.directory, 'locks')):
+            try:
+                os.mkdir(path, 0o700)
+            except FileExistsError:
+                pass
+            except OSError as e:
+                print(f"Shared cache disabled: can't create {path}: {str(e)}")
+                return False
+            info = os.lstat(path)
+            if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o022:
+                print(f"Shared cache disabled: {path} is not a directory owned by this user "
+                      f"and writable only by it")
+                return False
+        return True
+
+    def _name(self, key):
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def get_entry(self, key):
+        """Return (value, expires_at), or None if key is missing or expired"""
+        if not self.enabled:
+            return None
+        try:
+            with open(os.path.join(self.directory, self._name(key)), 'rb') as f:
+                expires_at = os.fstat(f.fileno()).st_mtime
+                if expires_at <= time.time():
+                    self.misses += 1
+                    return None
+                value = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            print(f"Error reading shared cache entry: {str(e)}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value, expires_at
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return None if entry is None else entry[0]
+
+    def set(self, key, value, ttl):
+        if not self.enabled or ttl <= 0:
+            return
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            if len(data) > self.max_value_bytes:
+                return
+            fd, path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                expires_at = time.time() + ttl
+                os.utime(path, (expires_at, expires_at))
+                # Atomic publish: readers see the old file or this one
+                os.replace(path, os.path.join(self.directory, self._name(key)))
+            except BaseException:
+                os.unlink(path)
+                raise
+            self.writes += 1
+        except Exception as e:
+            print(f"Error writing shared cache entry: {str(e)}")
+        self.prune_due()
+
+    def lock(self, key):
+        """Context manager holding key's cross-process lock (a no-op when disabled)"""
+        if not self.enabled or fcntl is None:
+            return nullcontext()
+        return self._flock(os.path.join(self.directory, 'locks', self._name(key)))
+
+    @contextmanager
+    def _flock(self, path):
+        with open(path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                os.utime(path)
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def prune_due(self):
+        now = time.monotonic()
+        if now - self._last_prune < self.prune_interval or not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_prune = now
+            self.prune()
+        finally:
+            self._prune_lock.release()
+
+    def prune(self):
+        """Remove expired entries, abandoned temporary files and idle lock files"""
+        now = time.time()
+        for directory, idle in ((self.directory, 0), (os.path.join(self.directory, 'locks'), _LOCK_IDLE)):
+            try:
+                files = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in files:
+                try:
+                    if not entry.is_file():
+                        continue
+                    mtime = entry.stat().st_mtime
+                    # Temporary files carry their write time until published
+                    if entry.name.startswith('.tmp-'):
+                        mtime += _LOCK_IDLE
+                    if mtime + idle <= now:
+                        os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        if not self.enabled:
+            return
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'directory': self.directory,
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+shared_cache = SharedCache()
@@ -0,0 +1,160 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# log2 of the number of HyperLogLog registers; 14 gives ~0.8% standard error
+SKETCH_PRECISION = int(os.environ.get('SKETCH_PRECISION', 14))
+
+# Capacity of the top KLL compactor; rank error is roughly 1.7 / k
+KLL_K = int(os.environ.get('KLL_K', 200))
+
+_rng = np.random.default_rng()
+
+
+def hash_values(values):
+    """Stable 64-bit hashes of non-NULL values, the same in every process"""
+    return pd.util.hash_array(np.asarray(values), categorize=True)
+
+
+def register_updates(hashes, precision=SKETCH_PRECISION):
+    """Split hashes into (register index, rank) pairs
+
+    The top precision bits pick the register; the rank is one more than the
+    number of leading zeros in the next 32 bits.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    rest = ((hashes << np.uint64(precision)) >> np.uint64(32)).astype(np.float64)
+    bit_length = np.where(rest > 0, np.floor(np.log2(np.maximum(rest, 1))) + 1, 0)
+    rank = (33 - bit_length).astype(np.uint8)
+    return index, rank
+
+
+def estimate(registers):
+    """Cardinality estimate from one register array (or the max of several)"""
+    registers = np.asarray(registers)
+    m = registers.shape[-1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)), axis=-1)
+    zeros = np.count_nonzero(registers == 0, axis=-1)
+    # Linear counting is more accurate while many registers are still empty
+    small = (raw <= 2.5 * m) & (zeros > 0)
+    linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where(small, linear, raw)
+
+
+class HyperLogLog:
+    """Mergeable distinct-count sketch over stable 64-bit hashes"""
+
+    def __init__(self, precision=SKETCH_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+
+    def add_hashes(self, hashes):
+        index, rank = register_updates(hashes, self.precision)
+        np.maximum.at(self.registers, index, rank)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=object)
+        self.add_hashes(hash_values(values[pd.notna(values)]))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        return int(round(float(estimate(self.registers))))
+
+    def __len__(self):
+        return self.count()
+
+
+class KLL:
+    """Mergeable quantile sketch (Karnin, Lang and Liberty's compactor hierarchy)
+
+    Level h holds items of weight 2**h. A level over capacity is sorted and
+    every other item is promoted, so memory stays O(k) however many values
+    are added. Until the first compaction every value is kept and quantiles
+    are exact.
+    """
+
+    def __init__(self, k=KLL_K):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+
+    def __len__(self):
+        return self.n
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def _compact(self, level):
+        if level + 1 == len(self.levels):
+            self.levels.append(np.empty(0))
+        items = np.sort(self.levels[level])
+        # An odd item out stays behind so the total weight is preserved
+        odd = len(items) % 2
+        self.levels[level] = items[len(items) - odd:]
+        promoted = items[_rng.integers(2):len(items) - odd:2]
+        self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+
+    def _compress(self):
+        while True:
+            for level, items in enumerate(self.levels):
+                if len(items) > self._capacity(level):
+                    self._compact(level)
+                    break
+            else:
+                return
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.n += len(values)
+        self._compress()
+        return self
+
+    def merge(self, other):
+        self.levels.extend(np.empty(0) for _ in range(len(other.levels) - len(self.levels)))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self._compress()
+        return self
+
+    @classmethod
+    def merged(cls, sketches, k=KLL_K):
+        """One sketch summarising all of sketches (which are left unchanged)"""
+        sketches = list(sketches)
+        sketch = cls(k)
+        depth = max((len(other.levels) for other in sketches), default=1)
+        sketch.levels = [
+            np.concatenate([np.empty(0)] + [other.levels[level] for other in sketches if level < len(other.levels)])
+            for level in range(depth)
+        ]
+        sketch.n = sum(other.n for other in sketches)
+        sketch._compress()
+        return sketch
+
+    def quantiles(self, qs):
+        """Interpolated quantiles, matching PERCENTILE_CONT while the sketch is exact"""
+        qs = np.asarray(qs, dtype=np.float64)
+        if not self.n:
+            return np.full(qs.shape, np.nan)
+        if len(self.levels) == 1:
+            return np.percentile(self.levels[0], qs * 100)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items, weights = items[order], weights[order]
+        # Each item sits at the midpoint of the rank range it stands for
+        positions = (np.cumsum(weights) - weights / 2) / weights.sum()
+        return np.interp(qs, positions, items)
+
+    def quantile(self, q):
+        return float(self.quantiles([q])[0])
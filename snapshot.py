@@ -0,0 +1,245 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from addresses import address_table
+from db import execute_sql
+from sql_templates import sql_template
+
+
+# Opt-in: keep an in-memory copy of main_volume_table and answer routes from it
+SNAPSHOT_ENABLED = os.environ.get('VOLUME_SNAPSHOT', '0') == '1'
+
+# Seconds between incremental syncs
+SNAPSHOT_INTERVAL = float(os.environ.get('VOLUME_SNAPSHOT_INTERVAL', 60))
+
+# Rows per upstream page while catching up
+SNAPSHOT_PAGE_SIZE = int(os.environ.get('VOLUME_SNAPSHOT_PAGE_SIZE', 50000))
+
+# Every sync re-reads this many seconds behind the watermark, so rows that
+# commit slightly out of timestamp order are still picked up
+SNAPSHOT_LOOKBACK = float(os.environ.get('VOLUME_SNAPSHOT_LOOKBACK', 300))
+
+EPOCH = datetime(1970, 1, 1)
+
+# Column name -> numpy dtype of the snapshot arrays
+SNAPSHOT_COLUMNS = {
+    'block_timestamp': 'datetime64[us]',
+    'order_uuid': object,
+    'transaction_hash': object,
+    'source_id': object,
+    'dest_id': object,
+    'source_chain': object,
+    'dest_chain': object,
+    'source_volume': 'float64',
+    'dest_volume': 'float64',
+    'total_volume': 'float64',
+    # Wallet addresses are stored as address_table ids
+    'sender_address_id': 'int32',
+    'maker_address_id': 'int32',
+}
+
+# Snapshot id column -> upstream address column
+_INTERNED = {
+    'sender_address_id': 'sender_address',
+    'maker_address_id': 'maker_address',
+}
+
+_SCHEMA = {
+    'block_timestamp': 'datetime',
+    'source_volume': 'float64',
+    'dest_volume': 'float64',
+    'total_volume': 'float64',
+}
+
+_PAGE_QUERY = """
+SELECT
+    block_timestamp,
+    order_uuid,
+    transaction_hash,
+    source_id,
+    dest_id,
+    source_chain,
+    dest_chain,
+    source_volume,
+    dest_volume,
+    total_volume,
+    sender_address,
+    maker_address
+FROM main_volume_table
+WHERE block_timestamp >= :since
+ORDER BY block_timestamp
+LIMIT :limit
+"""
+
+
+def _empty_columns():
+    return {name: np.empty(0, dtype=dtype) for name, dtype in SNAPSHOT_COLUMNS.items()}
+
+
+def _to_columns(df):
+    """Convert a decoded page into snapshot arrays (naive UTC timestamps)"""
+    columns = {}
+    for name, dtype in SNAPSHOT_COLUMNS.items():
+        if name == 'block_timestamp':
+            values = pd.DatetimeIndex(df[name])
+            if values.tz is not None:
+                values = values.tz_convert('UTC').tz_localize(None)
+            columns[name] = values.to_numpy(dtype)
+        elif name in _INTERNED:
+            columns[name] = address_table.intern(df[_INTERNED[name]])
+        elif dtype == object:
+            columns[name] = df[name].to_numpy(dtype=object)
+        else:
+            columns[name] = df[name].to_numpy(dtype=dtype, na_value=0)
+    return columns
+
+
+def _cursor(value):
+    """A page cursor as a full-precision timestamp literal
+
+    Bound datetimes are truncated to the second, which would re-read the
+    rows in [floor(last), last) and never advance within a one-second page.
+    """
+    return pd.Timestamp(value).strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+
+def _datetime64(value):
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+    return timestamp.to_datetime64().astype('datetime64[us]')
+
+
+class VolumeSnapshot:
+    """Columnar copy of main_volume_table, sorted by block_timestamp
+
+    Each sync re-reads the tail of the table from (watermark - lookback) and
+    replaces the snapshot's tail with it, so the copy stays exact without
+    assuming any column is unique. Readers always see a complete, immutable
+    set of arrays.
+    """
+
+    def __init__(self, interval=SNAPSHOT_INTERVAL, page_size=SNAPSHOT_PAGE_SIZE, lookback=SNAPSHOT_LOOKBACK):
+        self.interval = interval
+        self.page_size = page_size
+        self.lookback = timedelta(seconds=lookback)
+        self.ready = threading.Event()
+        self.last_sync = None
+        self._columns = _empty_columns()
+        self._subscribers = []
+        self._sync_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def __len__(self):
+        return len(self._columns['block_timestamp'])
+
+    @property
+    def watermark(self):
+        timestamps = self._columns['block_timestamp']
+        return timestamps[-1].astype(datetime) if len(timestamps) else None
+
+    def subscribe(self, callback):
+        """Call callback(snapshot, since) after every sync that changed rows at or after since"""
+        self._subscribers.append(callback)
+
+    def _fetch(self, since):
+        """Fetch every row with block_timestamp >= since, one page at a time"""
+        pages = []
+        limit = self.page_size
+        while True:
+            query = sql_template('volume_snapshot_page', _PAGE_QUERY).bind(since=_cursor(since), limit=limit)
+            df = execute_sql(query, ttl=0, schema=_SCHEMA)
+            if df is None:
+                raise RuntimeError(f"Snapshot page from {since} failed")
+            page = _to_columns(df) if not df.empty else _empty_columns()
+            timestamps = page['block_timestamp']
+            if len(timestamps) < limit:
+                pages.append(page)
+                break
+
+            last = timestamps[-1]
+            if timestamps[0] == last or last.astype(datetime) <= since:
+                # A whole page shares one timestamp, so the cursor can't
+                # advance; widen the page and retry
+                limit *= 2
+                continue
+            # The next page starts at the last timestamp, so drop its rows here
+            keep = np.searchsorted(timestamps, last, side='left')
+            pages.append({name: values[:keep] for name, values in page.items()})
+            since = last.astype(datetime)
+            limit = self.page_size
+
+        return {name: np.concatenate([page[name] for page in pages]) for name in SNAPSHOT_COLUMNS}
+
+    def sync(self):
+        """Pull rows newer than the watermark (minus lookback) and splice them in"""
+        with self._sync_lock:
+            watermark = self.watermark
+            since = EPOCH if watermark is None else (watermark - self.lookback).replace(microsecond=0)
+            tail = self._fetch(since)
+
+            current = self._columns
+            cut = np.searchsorted(current['block_timestamp'], np.datetime64(since, 'us'), side='left')
+            self._columns = {
+                name: np.concatenate([current[name][:cut], tail[name]])
+                for name in SNAPSHOT_COLUMNS
+            }
+            self.last_sync = time.time()
+            self.ready.set()
+
+        for callback in list(self._subscribers):
+            try:
+                callback(self, since)
+            except Exception as e:
+                print(f"Error in snapshot subscriber: {str(e)}")
+        return len(tail['block_timestamp'])
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                fetched = self.sync()
+                print(f"Volume snapshot synced {fetched} rows ({len(self)} total) "
+                      f"in {time.monotonic() - started:.2f}s")
+            except Exception as e:
+                print(f"Error syncing volume snapshot: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Start the background sync thread for this process (idempotent)"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # Threads don't survive a fork, so each gunicorn worker starts its own
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='volume-snapshot', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def columns(self, start=None, end=None, names=None):
+        """Return {name: array} for rows with start <= block_timestamp < end"""
+        current = self._columns
+        timestamps = current['block_timestamp']
+        lo = 0 if start is None else np.searchsorted(timestamps, _datetime64(start), side='left')
+        hi = len(timestamps) if end is None else np.searchsorted(timestamps, _datetime64(end), side='left')
+        return {name: current[name][lo:hi] for name in (names or SNAPSHOT_COLUMNS)}
+
+    def frame(self, start=None, end=None, names=None):
+        """Same as columns(), as a DataFrame"""
+        return pd.DataFrame(self.columns(start, end, names))
+
+
+volume_snapshot = VolumeSnapshot()
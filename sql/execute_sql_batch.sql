@@ -0,0 +1,19 @@
+-- Batch companion to the execute_sql RPC: runs every query in `queries`
+-- and returns one row per query, with all of its rows aggregated into a
+-- JSON array. Install it next to execute_sql with the same grants.
+CREATE OR REPLACE FUNCTION execute_sql_batch(queries text[])
+RETURNS TABLE(idx integer, result json)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    i integer;
+BEGIN
+    FOR i IN 1 .. COALESCE(array_length(queries, 1), 0) LOOP
+        RETURN QUERY EXECUTE format(
+            'SELECT %s::integer, COALESCE(json_agg(row_to_json(t)), ''[]''::json) FROM (%s) t',
+            i - 1,
+            queries[i]
+        );
+    END LOOP;
+END;
+$$;
@@ -0,0 +1,110 @@
+import hashlib
+import re
+import threading
+from datetime import date, datetime, timedelta
+
+from db import normalize_sql
+
+
+# Matches quoted literals and comments (skipped) or a :name placeholder.
+# The lookbehind keeps '::timestamp' style casts from being read as parameters.
+_PLACEHOLDER = re.compile(r"'(?:[^']|'')*'|--[^\n]*|(?<![:\w]):([A-Za-z_]\w*)")
+
+
+def _literal(value):
+    """Render a bound value as a normalized SQL literal"""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        # 7.0 and 7 are the same parameter
+        return str(int(value)) if value.is_integer() else repr(value)
+    if isinstance(value, datetime):
+        # Sub-second precision never matters for our windows and would defeat caching
+        return f"'{value.replace(microsecond=0, tzinfo=None).strftime('%Y-%m-%dT%H:%M:%S')}'"
+    if isinstance(value, date):
+        return f"'{value.isoformat()}'"
+    if isinstance(value, timedelta):
+        seconds = int(value.total_seconds())
+        if seconds % 86400 == 0:
+            return f"'{seconds // 86400} days'"
+        if seconds % 3600 == 0:
+            return f"'{seconds // 3600} hours'"
+        return f"'{seconds} seconds'"
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = sorted(value) if isinstance(value, (set, frozenset)) else value
+        return "(" + ", ".join(_literal(item) for item in items) + ")"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class SqlTemplate:
+    """A named SQL text with :name placeholders and a stable fingerprint"""
+
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+        self.fingerprint = hashlib.sha1(normalize_sql(text).encode()).hexdigest()[:16]
+        self.params = []
+        for match in _PLACEHOLDER.finditer(text):
+            param = match.group(1)
+            if param and param not in self.params:
+                self.params.append(param)
+
+    def bind(self, **params):
+        missing = [name for name in self.params if name not in params]
+        if missing:
+            raise ValueError(f"Missing parameters for {self.name}: {', '.join(missing)}")
+        return BoundQuery(self, {name: _literal(params[name]) for name in self.params})
+
+    def render(self, literals):
+        def substitute(match):
+            param = match.group(1)
+            return literals[param] if param else match.group(0)
+        return _PLACEHOLDER.sub(substitute, self.text)
+
+    def __repr__(self):
+        return f"SqlTemplate({self.name!r}, {self.fingerprint})"
+
+
+class BoundQuery:
+    """A template plus normalized parameters, ready for execute_sql"""
+
+    def __init__(self, template, literals):
+        self.template = template
+        self.literals = literals
+        self._sql = None
+
+    @property
+    def cache_key(self):
+        # Identical for every binding with the same normalized parameters,
+        # however the SQL text itself happens to be laid out
+        return (self.template.fingerprint,) + tuple(sorted(self.literals.items()))
+
+    @property
+    def sql(self):
+        if self._sql is None:
+            self._sql = self.template.render(self.literals)
+        return self._sql
+
+    def __str__(self):
+        return self.sql
+
+    def __repr__(self):
+        return f"BoundQuery({self.template.name!r}, {self.literals!r})"
+
+
+# Registry of every template seen so far, by name
+TEMPLATES = {}
+_templates_lock = threading.Lock()
+
+
+def sql_template(name, text):
+    """Return the registered template called name, registering it on first use"""
+    template = TEMPLATES.get(name)
+    if template is None or template.text != text:
+        with _templates_lock:
+            template = TEMPLATES[name] = SqlTemplate(name, text)
+    return template
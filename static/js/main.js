@@ -1556,35 +1556,19 @@ function createCumulativeCharts(data) {
         margin: { t: 30, b: 50, l: 60, r: 20 }
     };
 
-    // Calculate cumulative values
+    // Calculate cumulative values (the server sends unique users already accumulated)
     let cumulativeVolume = 0;
     let cumulativeTrades = 0;
-    const uniqueUsers = new Set();
 
     const processedData = data.map(d => {
         cumulativeVolume += Number(d.volume_total) || 0;
         cumulativeTrades += Number(d.trades_count) || 0;
-        
-        // Safely handle wallets array
-        try {
-            const walletsArray = d.wallets || [];
-            if (Array.isArray(walletsArray)) {
-                walletsArray.forEach(user => uniqueUsers.add(user));
-            } else if (typeof walletsArray === 'string') {
-                const parsedWallets = JSON.parse(walletsArray);
-                if (Array.isArray(parsedWallets)) {
-                    parsedWallets.forEach(user => uniqueUsers.add(user));
-                }
-            }
-        } catch (e) {
-            console.warn('Error processing wallets:', e);
-        }
 
         return {
             hour: new Date(d.hour),
             cumVolume: cumulativeVolume,
             cumTrades: cumulativeTrades,
-            cumUsers: uniqueUsers.size
+            cumUsers: Number(d.cumulative_users) || 0
         };
     }).sort((a, b) => a.hour - b.hour);
 
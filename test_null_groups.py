@@ -0,0 +1,110 @@
+"""Cube and snapshot routes against the SQL they replace, on data with NULL chains and assets
+
+Run with: python -m unittest test_null_groups (needs duckdb)
+"""
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+_data_dir = tempfile.mkdtemp(prefix='null-groups-')
+os.environ.update(SQL_BACKEND='duckdb', LOCAL_DATA_DIR=_data_dir, VOLUME_SNAPSHOT='1',
+                  RESPONSE_CACHE='0', SHARED_CACHE='0')
+
+
+def _write_trades(path, n=3000):
+    rng = np.random.default_rng(7)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    assets = np.array([f'A{i:02d}' for i in range(30)] + [None] * 6, dtype=object)
+    chains = np.array(['base', 'optimism', 'arbitrum', None], dtype=object)
+    timestamps = now - pd.to_timedelta(rng.uniform(60, 40 * 86400, n), unit='s')
+    orders = pd.DataFrame({'order_uuid': [f'o{i}' for i in range(n)], 'block_timestamp': timestamps})
+    orders.to_csv(os.path.join(path, 'order_placed.csv'), index=False)
+    orders.to_csv(os.path.join(path, 'match_executed.csv'), index=False)
+    pd.DataFrame({
+        'block_timestamp': timestamps,
+        'created_at': timestamps,
+        'order_uuid': [f'o{i}' for i in range(n)],
+        'transaction_hash': [f'0xt{i}' for i in range(n)],
+        'source_id': rng.choice(assets, n),
+        'dest_id': rng.choice(assets, n),
+        'source_chain': rng.choice(chains, n),
+        'dest_chain': rng.choice(chains, n),
+        'total_volume': rng.uniform(1, 1000, n),
+        'sender_address': [f'0x{i % 97:040x}' for i in range(n)],
+        'maker_address': [f'0x{i % 89 + 500:040x}' for i in range(n)],
+        'source_volume': rng.uniform(1, 1000, n),
+        'dest_volume': rng.uniform(1, 1000, n),
+    }).to_csv(os.path.join(path, 'main_volume_table.csv'), index=False)
+
+
+_write_trades(_data_dir)
+
+import app as dashboard  # noqa: E402 (reads the environment above)
+
+
+def _strict_json(data):
+    def reject(constant):
+        raise ValueError(f'{constant} is not valid JSON')
+    return json.loads(data, parse_constant=reject)
+
+
+class NullGroupParityTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        dashboard.volume_snapshot.sync()
+        cls.client = dashboard.app.test_client()
+
+    def both(self, path, ready):
+        """Return (precomputed, sql) JSON payloads of path"""
+        self.assertTrue(ready.wait(60))
+        precomputed = self.client.get(path)
+        ready.clear()
+        try:
+            sql = self.client.get(path)
+        finally:
+            ready.set()
+        self.assertEqual(precomputed.status_code, 200)
+        self.assertEqual(sql.status_code, 200)
+        return _strict_json(precomputed.data), _strict_json(sql.data)
+
+    def assertSamePayload(self, first, second, path=''):
+        if isinstance(first, dict):
+            self.assertEqual(sorted(first), sorted(second), path)
+            for key in first:
+                self.assertSamePayload(first[key], second[key], f'{path}.{key}')
+        elif isinstance(first, list):
+            self.assertEqual(len(first), len(second), path)
+            for i, (a, b) in enumerate(zip(first, second)):
+                self.assertSamePayload(a, b, f'{path}[{i}]')
+        elif isinstance(first, float):
+            self.assertAlmostEqual(first, second, delta=1e-6 * max(1, abs(first)), msg=path)
+        else:
+            self.assertEqual(first, second, path)
+
+    def test_histogram_ranks_null_asset_like_sql(self):
+        for time_range in ('all', '15'):
+            cube, sql = self.both(f'/histogram_data/{time_range}', dashboard.volume_cube.ready)
+            self.assertEqual(cube['assets'], sql['assets'])
+
+    def test_histogram_keeps_null_chain(self):
+        for time_range in ('all', '15'):
+            cube, sql = self.both(f'/histogram_data/{time_range}', dashboard.volume_cube.ready)
+            self.assertSamePayload(cube, sql)
+            self.assertIn(None, cube['chains'])
+            self.assertGreater(sum(cube['volumes'][cube['chains'].index(None)]), 0)
+
+    def test_pie_drops_null_groups(self):
+        for time_range in ('all', '15'):
+            cube, sql = self.both(f'/pie_data/{time_range}', dashboard.volume_cube.ready)
+            self.assertSamePayload(cube, sql)
+            self.assertNotIn(None, cube['chains'] + cube['assets'])
+
+    def test_sankey_keeps_null_groups(self):
+        for time_range in ('all', '15'):
+            snapshot, sql = self.both(f'/sankey_data/{time_range}', dashboard.volume_snapshot.ready)
+            self.assertSamePayload(snapshot, sql)
@@ -0,0 +1,94 @@
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+import pandas as pd
+
+from db import execute_sql
+
+
+# Window boundaries snap to multiples of this many seconds, so every request
+# inside the same bucket resolves to the same window (and the same cache keys)
+WINDOW_BUCKET_SECONDS = int(os.environ.get('WINDOW_BUCKET_SECONDS', 300))
+
+
+class OldestTimeUnavailable(RuntimeError):
+    """The oldest order time could not be read, so 'all' windows can't be resolved"""
+
+
+@lru_cache(maxsize=1)
+def get_oldest_time():
+    time_query = """
+    SELECT MIN(op.block_timestamp) AS oldest_time
+    FROM order_placed op
+    INNER JOIN match_executed me
+    ON op.order_uuid = me.order_uuid
+    """
+    time_point = execute_sql(time_query)
+    # Raising keeps lru_cache from remembering the failure
+    if time_point is None or time_point.empty or pd.isna(time_point['oldest_time'][0]):
+        raise OldestTimeUnavailable("Oldest order time query failed")
+    return time_point['oldest_time'][0]
+
+
+def floor_time(value, bucket_seconds):
+    """Round a naive datetime down to a multiple of bucket_seconds since the epoch"""
+    if bucket_seconds <= 1:
+        return value.replace(microsecond=0)
+    seconds = int((value - datetime(1970, 1, 1)).total_seconds())
+    return datetime(1970, 1, 1) + timedelta(seconds=seconds - seconds % bucket_seconds)
+
+
+def _naive(value):
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+    return timestamp.to_pydatetime()
+
+
+class TimeWindow(namedtuple('TimeWindow', ['time_range', 'start', 'end', 'bucket_seconds'])):
+    """A quantized [start, end) window for a time_range such as 'all', '15' or '0.5'"""
+
+    @property
+    def key(self):
+        return f"{self.time_range}:{self.start:%Y-%m-%dT%H:%M:%S}:{self.end:%Y-%m-%dT%H:%M:%S}"
+
+    @property
+    def days(self):
+        return (self.end - self.start).total_seconds() / 86400
+
+
+def canonical_range(time_range):
+    """Canonical form of a time_range ('all', '15', '0.5') without querying anything
+
+    Raises ValueError for anything that isn't 'all' or a positive number of days.
+    """
+    time_range = str(time_range)
+    if time_range == 'all':
+        return time_range
+    days = float(time_range)
+    if not days > 0 or days == float('inf'):
+        raise ValueError(f"Invalid time range: {time_range}")
+    # '15' and '15.0' are the same window
+    return str(int(days)) if days.is_integer() else str(days)
+
+
+def resolve_window(time_range, bucket_seconds=None, now=None):
+    """Resolve a route's time_range into a bucket-aligned TimeWindow
+
+    'all' starts at the oldest matched order; anything else is a (possibly
+    fractional) number of days back from now. Raises ValueError for
+    anything else, and OldestTimeUnavailable for 'all' while upstream is failing.
+    """
+    bucket_seconds = WINDOW_BUCKET_SECONDS if bucket_seconds is None else bucket_seconds
+    time_range = canonical_range(time_range)
+    # Naive UTC, like the timestamps it is compared with
+    end = floor_time(now or datetime.now(timezone.utc).replace(tzinfo=None), bucket_seconds)
+
+    if time_range == 'all':
+        start = floor_time(_naive(get_oldest_time()), bucket_seconds)
+    else:
+        start = floor_time(end - timedelta(days=float(time_range)), bucket_seconds)
+
+    return TimeWindow(time_range, start, end, bucket_seconds)